@@ -0,0 +1,370 @@
+"""Command line tools for talking to Emotiva processors outside Home Assistant.
+
+Run from the Home Assistant config folder, e.g.
+
+    python -m custom_components.emotiva discover
+    python -m custom_components.emotiva command 192.168.1.20 power_on
+    python -m custom_components.emotiva tail 192.168.1.20 --capture emo.bin
+    python -m custom_components.emotiva load 192.168.1.20 --duration 30
+    python -m custom_components.emotiva replay emo.bin
+
+The tools bind the same local ports as the integration, so stop Home
+Assistant, or run them on another machine, first.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from .capture import DIRECTION_IN, EmotivaCapture, read_capture
+from .const import DEFAULT_CTRL_PORT, DEFAULT_NOTIFY_PORT
+from .emotiva import Emotiva, EmotivaNotifier
+from .protocol import (
+    SUPPORTED_VERSIONS,
+    get_protocol,
+    parse_response,
+    parse_transponder,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _Session(object):
+    """Command and notification sockets for one processor."""
+
+    def __init__(self, args, on_notify=None, on_reply=None):
+        self.host = args.host
+        self.ctrl_port = args.control_port
+        self.notify_port = args.notify_port
+        # Processors send to the port numbers they listen on, so bind those by
+        # default.  A stand-in on the same host needs them left free.
+        self.local_ctrl_port = _default(args.local_control_port, self.ctrl_port)
+        self.local_notify_port = _default(args.local_notify_port, self.notify_port)
+        self.protocol = get_protocol(args.protocol)
+        self.command = EmotivaNotifier()
+        self.notify = EmotivaNotifier()
+        self._on_notify = on_notify
+        self._on_reply = on_reply
+
+    async def async_start(self, capture=None):
+        await self.command._async_start("0.0.0.0", self.local_ctrl_port)
+        await self.notify._async_start("0.0.0.0", self.local_notify_port)
+        self.command.capture = self.notify.capture = capture
+        await self.command._async_register(self._reply, self.host)
+        await self.notify._async_register(self._notify, self.host)
+
+    async def async_stop(self):
+        await self.command._async_stop()
+        await self.notify._async_stop()
+
+    def _reply(self, data):
+        if self._on_reply is not None:
+            self._on_reply(data)
+
+    def _notify(self, data):
+        if self._on_notify is not None:
+            self._on_notify(data)
+
+    async def async_send(self, msg):
+        await self.command.async_send(msg, (self.host, self.ctrl_port))
+
+
+def _default(value, default):
+    return default if value is None else value
+
+
+def _print_properties(protocol, data, started=None):
+    resp = parse_response(data)
+    if resp is None or len(resp) == 0:
+        return
+    prefix = "" if started is None else "%8.3f " % (time.monotonic() - started)
+    seq = protocol.sequence(resp)
+    print("%s%s%s" % (prefix, resp.tag, "" if seq is None else " sequence=%d" % seq))
+    for name, value, visible in protocol.iter_properties(resp):
+        print(
+            "    %-16s %s%s"
+            % (name, value, "" if visible in ("", "true") else " (hidden)")
+        )
+
+
+async def _async_discover(args):
+    found = await Emotiva.async_discover(
+        args.host or None, timeout=args.timeout, version=float(args.protocol)
+    )
+    for ip, xml in sorted(found):
+        info = parse_transponder(xml)
+        print(
+            "%-15s %-20s %-8s protocol %s control %s notify %s"
+            % (
+                ip,
+                info.get("name", ""),
+                info.get("model", ""),
+                info.get("version", ""),
+                info.get("control_port", ""),
+                info.get("notify_port", ""),
+            )
+        )
+    return 0 if found else 1
+
+
+async def _async_command(args):
+    session = _Session(args)
+    await session.async_start()
+    try:
+        msg = session.protocol.control_request(args.cmd, args.value)
+        await session.async_send(msg)
+    finally:
+        await session.async_stop()
+    return 0
+
+
+async def _async_tail(args):
+    started = time.monotonic()
+    session = None
+
+    def _on_data(data):
+        _print_properties(session.protocol, data, started)
+
+    session = _Session(args, _on_data, _on_data)
+    capture = _start_capture(args)
+    await session.async_start(capture)
+    events = args.events or sorted(Emotiva.NOTIFY_EVENTS)
+    await session.async_send(session.protocol.subscribe_request(events))
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await session.async_send(session.protocol.unsubscribe_request(events))
+        await session.async_stop()
+        _stop_capture(capture)
+    return 0
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class _Outstanding(object):
+    """Requests awaiting a reply, matched to replies in order."""
+
+    def __init__(self):
+        self.sent = []
+        self.latencies = []
+        self.lost = 0
+
+    def add(self):
+        self.sent.append(time.monotonic())
+
+    def reply(self):
+        if self.sent:
+            self.latencies.append(time.monotonic() - self.sent.pop(0))
+
+    def expire(self, timeout):
+        cutoff = time.monotonic() - timeout
+        while self.sent and self.sent[0] < cutoff:
+            self.sent.pop(0)
+            self.lost += 1
+
+    def report(self, name):
+        pct = [_percentile(self.latencies, p) for p in (50, 90, 99, 100)]
+        total = len(self.latencies) + self.lost
+        print(
+            "%-8s sent %5d  replies %5d  lost %5d (%.1f%%)"
+            % (name, total, len(self.latencies), self.lost, 100 * self.lost / total)
+            if total
+            else "%-8s sent     0" % name
+        )
+        if self.latencies:
+            print(
+                "         p50 %.1fms  p90 %.1fms  p99 %.1fms  max %.1fms"
+                % tuple(v * 1000 for v in pct)
+            )
+
+
+async def _async_load(args):
+    """Send volume steps and refreshes at fixed rates and measure replies.
+
+    Volume steps alternate up and down, so the volume ends where it began.
+    A step is answered by a volume notification, and a refresh by an
+    emotivaUpdate reply.
+    """
+    commands = _Outstanding()
+    refreshes = _Outstanding()
+
+    def _on_notify(data):
+        if b'"volume"' in data or b"<volume" in data:
+            commands.reply()
+
+    def _on_reply(data):
+        if b"emotivaUpdate" in data:
+            refreshes.reply()
+        else:
+            _on_notify(data)
+
+    session = _Session(args, _on_notify, _on_reply)
+    capture = _start_capture(args)
+    await session.async_start(capture)
+    protocol = session.protocol
+    await session.async_send(protocol.subscribe_request(["volume"]))
+    await asyncio.sleep(0.5)
+
+    loop = asyncio.get_running_loop()
+
+    async def _run(rate, send):
+        if rate <= 0:
+            return
+        start = loop.time()
+        i = 0
+        while loop.time() - start < args.duration:
+            i += 1
+            await send(i)
+            delay = start + i / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _step(i):
+        commands.add()
+        await session.async_send(protocol.control_request("volume", 1 if i % 2 else -1))
+
+    async def _refresh(i):
+        refreshes.add()
+        await session.async_send(protocol.update_request(args.refresh_events))
+
+    async def _expire():
+        while True:
+            await asyncio.sleep(0.1)
+            commands.expire(args.reply_timeout)
+            refreshes.expire(args.reply_timeout)
+
+    expirer = loop.create_task(_expire())
+    try:
+        await asyncio.gather(
+            _run(args.command_rate, _step), _run(args.refresh_rate, _refresh)
+        )
+        await asyncio.sleep(args.reply_timeout)
+        commands.expire(0)
+        refreshes.expire(0)
+    finally:
+        expirer.cancel()
+        await session.async_send(protocol.unsubscribe_request(["volume"]))
+        await session.async_stop()
+        _stop_capture(capture)
+
+    commands.report("commands")
+    refreshes.report("refresh")
+    return 0
+
+
+def _replay(args):
+    protocol = get_protocol(args.protocol)
+    records = read_capture(args.file)
+    first = None
+    for ts, direction, peer, data in records:
+        if direction != DIRECTION_IN:
+            continue
+        if first is None:
+            first = ts
+        print("%8.3f %s:%d" % (ts - first, peer[0], peer[1]))
+        _print_properties(protocol, data)
+    return 0
+
+
+def _start_capture(args):
+    if not getattr(args, "capture", None):
+        return None
+    capture = EmotivaCapture(args.capture)
+    capture.start()
+    return capture
+
+
+def _stop_capture(capture):
+    if capture is not None:
+        capture.close()
+        print("Captured %d datagrams" % capture.records, file=sys.stderr)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m custom_components.emotiva",
+        description="Talk to Emotiva processors without Home Assistant",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--protocol", default=SUPPORTED_VERSIONS[0])
+    sub = parser.add_subparsers(dest="tool", required=True)
+
+    p = sub.add_parser("discover", help="find processors on the network")
+    p.add_argument("host", nargs="*", help="ping these hosts rather than broadcast")
+    p.add_argument("--timeout", type=float, default=2.0)
+
+    def _session_args(p):
+        p.add_argument("host")
+        p.add_argument("--control-port", type=int, default=DEFAULT_CTRL_PORT)
+        p.add_argument("--notify-port", type=int, default=DEFAULT_NOTIFY_PORT)
+        p.add_argument(
+            "--local-control-port",
+            type=int,
+            help="port to send from, default the control port, 0 for any",
+        )
+        p.add_argument(
+            "--local-notify-port",
+            type=int,
+            help="port to receive notifications on, default the notify port",
+        )
+
+    p = sub.add_parser("command", help="send one command")
+    _session_args(p)
+    p.add_argument("cmd", help="e.g. power_on, volume, source_1")
+    p.add_argument("value", nargs="?", default="0")
+
+    p = sub.add_parser("tail", help="subscribe and print notifications")
+    _session_args(p)
+    p.add_argument("--events", nargs="*", help="properties to subscribe to")
+    p.add_argument("--duration", type=float, help="seconds, default forever")
+    p.add_argument("--capture", help="also write a capture file")
+
+    p = sub.add_parser("load", help="measure latency and loss under load")
+    _session_args(p)
+    p.add_argument("--duration", type=float, default=30.0)
+    p.add_argument("--command-rate", type=float, default=2.0, help="per second")
+    p.add_argument("--refresh-rate", type=float, default=1.0, help="per second")
+    p.add_argument("--refresh-events", nargs="*", default=["power", "volume"])
+    p.add_argument("--reply-timeout", type=float, default=2.0)
+    p.add_argument("--capture", help="also write a capture file")
+
+    p = sub.add_parser("replay", help="print the notifications in a capture")
+    p.add_argument("file")
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format="%(levelname)s %(name)s: %(message)s",
+    )
+    if args.tool == "replay":
+        return _replay(args)
+    tool = {
+        "discover": _async_discover,
+        "command": _async_command,
+        "tail": _async_tail,
+        "load": _async_load,
+    }[args.tool]
+    try:
+        return asyncio.run(tool(args))
+    except KeyboardInterrupt:
+        return 0
+    except OSError as e:
+        print("Error: %s" % e, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
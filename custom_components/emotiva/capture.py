@@ -0,0 +1,183 @@
+"""Capture and replay of raw datagrams exchanged with Emotiva processors."""
+
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+from .clock import Clock
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"EMOCAP1\n"
+
+DIRECTION_IN = 0
+DIRECTION_OUT = 1
+
+# timestamp, direction, peer ip, peer port, payload length
+_RECORD = struct.Struct("<dB4sHH")
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+
+class EmotivaCapture(object):
+    """Write timestamped datagrams to a rotating binary log.
+
+    Records are queued from the event loop and written by a worker thread,
+    so capturing never blocks the loop on file I/O.
+    """
+
+    def __init__(
+        self, path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT
+    ):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._file = None
+        # Set if the file can't be opened, so nothing more is queued
+        self._failed = False
+        self.records = 0
+        self.dropped = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="emotiva capture writer", daemon=True
+        )
+        self._thread.start()
+
+    def record(self, direction, peer, data):
+        """Queue a datagram for writing.  Safe to call from the event loop."""
+        if self._failed:
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait((time.time(), direction, peer, data))
+        except Exception:
+            self.dropped += 1
+
+    def close(self):
+        """Flush outstanding records and stop the writer.  Blocks."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._file = open(self._path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self._backup_count - 1, 0, -1):
+            src = "%s.%d" % (self._path, i)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (self._path, i + 1))
+        if self._backup_count > 0:
+            os.replace(self._path, self._path + ".1")
+        else:
+            os.remove(self._path)
+        self._open()
+
+    def _run(self):
+        try:
+            self._open()
+        except OSError as e:
+            _LOGGER.error("Cannot open capture file %s: %s", self._path, e.strerror)
+            self._failed = True
+            # Discard whatever was queued before the failure was seen
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not None:
+                    self.dropped += 1
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            ts, direction, peer, data = item
+            try:
+                self._file.write(
+                    _RECORD.pack(
+                        ts,
+                        direction,
+                        socket.inet_aton(peer[0]),
+                        peer[1],
+                        len(data),
+                    )
+                )
+                self._file.write(data)
+                self.records += 1
+                if self._queue.empty():
+                    self._file.flush()
+                if self._file.tell() >= self._max_bytes:
+                    self._rotate()
+            except OSError as e:
+                _LOGGER.error("Error writing capture file: %s", e.strerror)
+                self.dropped += 1
+
+        self._file.close()
+        self._file = None
+
+
+def read_capture(path):
+    """Return the list of (timestamp, direction, (ip, port), data) in a capture."""
+    records = []
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not an Emotiva capture file" % path)
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            ts, direction, ip, port, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                _LOGGER.warning("Truncated record at end of %s", path)
+                break
+            records.append((ts, direction, (socket.inet_ntoa(ip), port), data))
+    return records
+
+
+async def async_replay(records, handler, speed=1.0, peer_ip=None, clock=None):
+    """Feed captured inbound datagrams to handler.
+
+    speed is a multiple of real time.  A speed of 0 replays as fast as
+    possible.  Returns the number of datagrams replayed and the elapsed time.
+    """
+    clock = clock or Clock()
+    count = 0
+    start = clock.monotonic()
+    first_ts = None
+    for ts, direction, peer, data in records:
+        if direction != DIRECTION_IN:
+            continue
+        if peer_ip is not None and peer[0] != peer_ip:
+            continue
+        if first_ts is None:
+            first_ts = ts
+        if speed > 0:
+            delay = start + (ts - first_ts) / speed - clock.monotonic()
+            if delay > 0:
+                await clock.sleep(delay)
+        else:
+            # Yield so that the handler's scheduled work can run
+            await clock.sleep(0)
+        handler(data)
+        count += 1
+    return count, clock.monotonic() - start
@@ -0,0 +1,39 @@
+"""Injectable time source for the processor session."""
+
+import asyncio
+import time
+
+
+class Clock(object):
+    """Time source and task runner for a processor's timers.
+
+    The default uses the running event loop, but reads time.monotonic() so
+    that a session can be created before the loop runs.  Pass a replacement
+    to Emotiva to drive its optimistic state, ramps, ping watcher, event
+    settling and replay from a simulated clock, or to the transponder
+    listener and discovery to time their searches.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        """Return the wall clock time, for timestamps shown to people."""
+        return time.time()
+
+    def call_later(self, delay, cb, *args):
+        return asyncio.get_running_loop().call_later(delay, cb, *args)
+
+    def call_at(self, when, cb, *args):
+        # The loop's own time needn't share a base with time.monotonic()
+        return self.call_later(when - self.monotonic(), cb, *args)
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    async def wait_for(self, aw, timeout):
+        """Await aw, raising TimeoutError if it takes longer than timeout."""
+        return await asyncio.wait_for(aw, timeout)
+
+    def create_task(self, coro, name=None):
+        return asyncio.get_running_loop().create_task(coro, name=name)
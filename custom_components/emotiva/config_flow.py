@@ -6,19 +6,45 @@ import voluptuous as vol
 
 from .const import (
     DOMAIN,
+    CONF_CTRL_PORT,
     CONF_NOTIFICATIONS,
+    CONF_NOTIFY_PORT,
+    CONF_PASSIVE_DISCOVERY,
+    CONF_PROCESSORS,
+    CONF_TEARDOWN_TIMEOUT,
     CONF_PROTO_VER,
     CONF_TYPE,
     CONF_PING_INTERVAL,
+    CONF_CAPTURE,
+    CONF_VOLUME_CURVE,
+    CONF_VOLUME_MAX,
+    CONF_VOLUME_MIN,
+    DEFAULT_CTRL_PORT,
+    DEFAULT_NOTIFY_PORT,
+    DEFAULT_TEARDOWN_TIMEOUT,
+    PROBE_TIMEOUT,
+)
+from .emotiva import Emotiva
+from .interfaces import async_get_interfaces, broadcast_addresses
+from .protocol import SUPPORTED_VERSIONS, parse_transponder
+from .volume import (
+    CURVE_LINEAR,
+    SLIDER_CURVES,
+    VOLUME_MAX,
+    VOLUME_MIN,
+    VOLUME_STEP,
+    slider_curve,
 )
 
 from homeassistant import config_entries
 from homeassistant.const import CONF_HOST, CONF_NAME, CONF_MODEL
 from homeassistant.core import callback
+from homeassistant.util import slugify
 
 import homeassistant.helpers.config_validation as cv
 
 from homeassistant.helpers.selector import (
+    SelectOptionDict,
     SelectSelector,
     SelectSelectorConfig,
     SelectSelectorMode,
@@ -57,7 +83,7 @@ EMO_MANUAL_SCHEMA = vol.Schema(
             SelectSelector(
                 SelectSelectorConfig(
                     mode=SelectSelectorMode.DROPDOWN,
-                    options=["3.0", "2.0"],
+                    options=list(SUPPORTED_VERSIONS),
                 )
             ),
             vol.Coerce(float),
@@ -78,44 +104,208 @@ EMO_OPTIONS_SCHEMA = vol.Schema(
             ),
             vol.Coerce(int),
         ),
+        vol.Optional(
+            CONF_CAPTURE,
+            default=False,
+        ): cv.boolean,
+        vol.Optional(
+            CONF_PASSIVE_DISCOVERY,
+            default=False,
+        ): cv.boolean,
+        vol.Optional(CONF_TEARDOWN_TIMEOUT): vol.All(
+            NumberSelector(
+                NumberSelectorConfig(min=1, max=30, mode=NumberSelectorMode.SLIDER)
+            ),
+            vol.Coerce(int),
+        ),
+        vol.Optional(CONF_VOLUME_MIN): vol.All(
+            NumberSelector(
+                NumberSelectorConfig(
+                    min=VOLUME_MIN,
+                    max=VOLUME_MAX,
+                    step=VOLUME_STEP,
+                    unit_of_measurement="dB",
+                    mode=NumberSelectorMode.BOX,
+                )
+            ),
+            vol.Coerce(float),
+        ),
+        vol.Optional(CONF_VOLUME_MAX): vol.All(
+            NumberSelector(
+                NumberSelectorConfig(
+                    min=VOLUME_MIN,
+                    max=VOLUME_MAX,
+                    step=VOLUME_STEP,
+                    unit_of_measurement="dB",
+                    mode=NumberSelectorMode.BOX,
+                )
+            ),
+            vol.Coerce(float),
+        ),
+        vol.Optional(CONF_VOLUME_CURVE): SelectSelector(
+            SelectSelectorConfig(
+                mode=SelectSelectorMode.DROPDOWN,
+                options=list(SLIDER_CURVES),
+                translation_key=CONF_VOLUME_CURVE,
+            )
+        ),
     }
 )
 
 
+def _processor_data(host, info, conf_type, defaults={}):
+    """Return the entry data for a processor from its transponder info."""
+    data = {
+        CONF_TYPE: conf_type,
+        CONF_HOST: host,
+        CONF_NAME: defaults.get(CONF_NAME) or info.get("name"),
+        CONF_MODEL: info.get("model") or defaults.get(CONF_MODEL),
+        CONF_PROTO_VER: info.get("version") or defaults.get(CONF_PROTO_VER),
+        CONF_CTRL_PORT: info.get("control_port", DEFAULT_CTRL_PORT),
+        CONF_NOTIFY_PORT: info.get("notify_port", DEFAULT_NOTIFY_PORT),
+    }
+    if not data[CONF_NAME] or not data[CONF_MODEL] or not data[CONF_PROTO_VER]:
+        return None
+    return data
+
+
 class EmotivaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_PUSH
 
+    def __init__(self) -> None:
+        """Initialize the config flow."""
+        self._discovered = {}
+
     async def async_step_user(self, user_input=None):
         """Invoked when a user initiates a flow via the user interface."""
         if user_input is not None:
             if user_input[CONF_TYPE] == "Discover":
-                # Input is valid, set data.
-                self.data = user_input
-                return self.async_create_entry(
-                    title="Emotiva Processor", data=self.data
-                )
+                return await self.async_step_discover()
             else:
-                return self.async_show_form(
-                    step_id="manual", data_schema=EMO_MANUAL_SCHEMA
-                )
+                return await self.async_step_manual()
 
         # If there is no user input or there were errors, show the form again, including any errors that were found with the input.
         return self.async_show_form(step_id="user", data_schema=EMO_CONFIG_SCHEMA)
 
+    async def async_step_discover(self, user_input=None):
+        """Search for processors which aren't already configured."""
+        configured = self._async_current_ids()
+        self._discovered = {}
+
+        interfaces = await async_get_interfaces(self.hass)
+        for _ip, _xml in await Emotiva.async_discover(
+            listener=self.hass.data.get(DOMAIN, {}).get("transponder_listener"),
+            broadcasts=broadcast_addresses(interfaces),
+        ):
+            data = _processor_data(_ip, parse_transponder(_xml), "Discover")
+            if data is None:
+                _LOGGER.debug("Incomplete transponder response from %s", _ip)
+                continue
+            if slugify(data[CONF_NAME]) in configured:
+                _LOGGER.debug("%s is already configured", data[CONF_NAME])
+                continue
+            self._discovered[_ip] = data
+
+        if not self._discovered:
+            return self.async_show_form(
+                step_id="user",
+                data_schema=EMO_CONFIG_SCHEMA,
+                errors={"base": "no_processors"},
+            )
+
+        return await self.async_step_select()
+
+    async def async_step_select(self, user_input=None):
+        """Choose which of the discovered processors to add."""
+        errors = {}
+
+        if user_input is not None:
+            selected = [self._discovered[_ip] for _ip in user_input[CONF_PROCESSORS]]
+            if selected:
+                # A flow creates one entry, so start a flow for each of the others
+                for data in selected[1:]:
+                    self.hass.async_create_task(
+                        self.hass.config_entries.flow.async_init(
+                            DOMAIN,
+                            context={"source": config_entries.SOURCE_IMPORT},
+                            data=data,
+                        )
+                    )
+                return await self._async_create_processor_entry(selected[0])
+            errors["base"] = "no_selection"
+
+        return self.async_show_form(
+            step_id="select",
+            errors=errors,
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        CONF_PROCESSORS, default=list(self._discovered)
+                    ): SelectSelector(
+                        SelectSelectorConfig(
+                            mode=SelectSelectorMode.LIST,
+                            multiple=True,
+                            options=[
+                                SelectOptionDict(
+                                    value=_ip,
+                                    label="%s (%s, protocol %s) at %s"
+                                    % (
+                                        data[CONF_NAME],
+                                        data[CONF_MODEL],
+                                        data[CONF_PROTO_VER],
+                                        _ip,
+                                    ),
+                                )
+                                for _ip, data in self._discovered.items()
+                            ],
+                        )
+                    )
+                }
+            ),
+        )
+
+    async def async_step_import(self, import_data):
+        """Add a processor selected with others in the discovery step."""
+        return await self._async_create_processor_entry(import_data)
+
     async def async_step_manual(self, user_input=None):
         """Invoked when a user initiates a flow via the user interface."""
+        errors = {}
+
         if user_input is not None:
-            # Input is valid, set data.
-            self.data = user_input
-            self.data[CONF_TYPE] = "Manual"
-            return self.async_create_entry(title="Emotiva Processor", data=self.data)
+            # Check the processor answers before creating the entry
+            receivers = await Emotiva.async_discover(
+                hosts=[user_input[CONF_HOST]],
+                timeout=PROBE_TIMEOUT,
+                listener=self.hass.data.get(DOMAIN, {}).get("transponder_listener"),
+            )
+            if receivers:
+                # Replies are matched to processors by address, so store the
+                # address a host name resolved to
+                _ip, _xml = receivers[0]
+                data = _processor_data(
+                    _ip,
+                    parse_transponder(_xml),
+                    "Manual",
+                    defaults=user_input,
+                )
+                return await self._async_create_processor_entry(data)
+            errors["base"] = "cannot_connect"
 
         # If there is no user input or there were errors, show the form again, including any errors that were found with the input.
         return self.async_show_form(
             step_id="manual",
-            data_schema=EMO_MANUAL_SCHEMA,
+            data_schema=self.add_suggested_values_to_schema(
+                EMO_MANUAL_SCHEMA, user_input or {}
+            ),
+            errors=errors,
         )
 
+    async def _async_create_processor_entry(self, data):
+        await self.async_set_unique_id(slugify(data[CONF_NAME]))
+        self._abort_if_unique_id_configured(updates={CONF_HOST: data[CONF_HOST]})
+        return self.async_create_entry(title=data[CONF_NAME], data=data)
+
     @staticmethod
     @callback
     def async_get_options_flow(config_entry):
@@ -132,15 +322,23 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         _LOGGER.debug("1 user_input %s", user_input)
         """Manage the options."""
 
+        errors = {}
+
         if user_input is not None:
-            if user_input["delete_existing"]:
-                _LOGGER.debug("Deleting existing notification entry")
-                del user_input[CONF_NOTIFICATIONS]
-            _LOGGER.debug("Returning %s", user_input)
-            return self.async_create_entry(title="", data=user_input)
+            if user_input.get(CONF_VOLUME_MIN, VOLUME_MIN) >= user_input.get(
+                CONF_VOLUME_MAX, VOLUME_MAX
+            ):
+                errors["base"] = "invalid_volume_range"
+            else:
+                if user_input["delete_existing"]:
+                    _LOGGER.debug("Deleting existing notification entry")
+                    user_input.pop(CONF_NOTIFICATIONS, None)
+                _LOGGER.debug("Returning %s", user_input)
+                return self.async_create_entry(title="", data=user_input)
 
         return self.async_show_form(
             step_id="init",
+            errors=errors,
             data_schema=self.add_suggested_values_to_schema(
                 EMO_OPTIONS_SCHEMA,
                 {
@@ -151,6 +349,22 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                         CONF_PING_INTERVAL, 60
                     ),
                     "delete_existing": False,
+                    CONF_CAPTURE: self.config_entry.options.get(CONF_CAPTURE, False),
+                    CONF_PASSIVE_DISCOVERY: self.config_entry.options.get(
+                        CONF_PASSIVE_DISCOVERY, False
+                    ),
+                    CONF_TEARDOWN_TIMEOUT: self.config_entry.options.get(
+                        CONF_TEARDOWN_TIMEOUT, DEFAULT_TEARDOWN_TIMEOUT
+                    ),
+                    CONF_VOLUME_MIN: self.config_entry.options.get(
+                        CONF_VOLUME_MIN, VOLUME_MIN
+                    ),
+                    CONF_VOLUME_MAX: self.config_entry.options.get(
+                        CONF_VOLUME_MAX, VOLUME_MAX
+                    ),
+                    CONF_VOLUME_CURVE: slider_curve(
+                        self.config_entry.options.get(CONF_VOLUME_CURVE, CURVE_LINEAR)
+                    ),
                 },
             ),
         )
@@ -8,7 +8,33 @@ CONF_DISCOVER = "discover"
 CONF_MANUAL = "manual"
 CONF_TYPE = "type"
 CONF_PING_INTERVAL = "ping_interval"
+CONF_PROCESSORS = "processors"
+CONF_PASSIVE_DISCOVERY = "passive_discovery"
+CONF_TEARDOWN_TIMEOUT = "teardown_timeout"
+CONF_CAPTURE = "capture"
+CONF_VOLUME_MIN = "volume_min"
+CONF_VOLUME_MAX = "volume_max"
+CONF_VOLUME_CURVE = "volume_curve"
+
+# Seconds to wait for processors to answer a discovery ping
+DISCOVERY_TIMEOUT = 2.0
+# Seconds to wait for a manually entered processor to answer
+PROBE_TIMEOUT = 3.0
+# Seconds allowed for unsubscribing and stopping processors on unload
+DEFAULT_TEARDOWN_TIMEOUT = 5
+# Seconds between pings to known processors when listening passively
+PASSIVE_PROBE_INTERVAL = 300
 
 DOMAIN = "emotiva"
 DEFAULT_NAME = "Emotiva Processor"
 SERVICE_SEND_COMMAND = "send_command"
+SERVICE_REPLAY_CAPTURE = "replay_capture"
+SERVICE_VOLUME_RAMP = "volume_ramp"
+SERVICE_GROUP_COMMAND = "group_command"
+SERVICE_GET_HISTORY = "get_history"
+
+CAPTURE_FILE = "capture.bin"
+
+STORAGE_VERSION = 1
+# Seconds to wait for further changes before writing the saved state
+STORAGE_SAVE_DELAY = 10
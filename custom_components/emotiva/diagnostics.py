@@ -0,0 +1,38 @@
+"""Diagnostics support for the emotiva component."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant import config_entries, core
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_HOST
+
+from .const import DOMAIN
+
+TO_REDACT = {CONF_HOST}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+
+    return {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+        "startup_timing": entry_data["timing"],
+        "last_teardown": hass.data[DOMAIN].get("teardown", {}).get(entry.entry_id),
+        "processors": [device.diagnostics() for device in entry_data["emotiva"]],
+        "notifiers": [
+            _notifier_diagnostics(notifiers)
+            for notifiers in hass.data[DOMAIN].get("notifiers", {}).values()
+        ],
+    }
+
+
+def _notifier_diagnostics(notifiers) -> dict[str, Any]:
+    return {
+        "subscription": notifiers.subscription.diagnostics(),
+        "command": notifiers.command.diagnostics(),
+    }
@@ -1,14 +1,24 @@
 import asyncio
 import logging
 import socket
-import sys
-import time
-
-import asyncio_datagram
-from lxml import etree
-from asyncping3 import ping
-
-from .const import CONF_PING_INTERVAL
+from collections import deque
+
+from .capture import DIRECTION_IN, DIRECTION_OUT, async_replay
+from .clock import Clock
+from .const import DISCOVERY_TIMEOUT, STORAGE_SAVE_DELAY
+from .events import EVENT_TYPES, ChangeEvents
+from .history import KIND_COMMAND, KIND_LATENCY, KIND_PROPERTY, History
+from .models import get_profile
+from .protocol import (
+    MAX_DATAGRAM_SIZE,
+    XML_HEADER,
+    build_request,
+    get_protocol,
+    is_notification,
+    parse_response,
+    parse_transponder,
+)
+from .volume import CURVE_LINEAR, VolumeCurve, ramp_schedule
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,119 +39,404 @@ class InvalidModeError(Error):
     pass
 
 
+async def ping(host, timeout):
+    # asyncping3 is only needed once the ping watcher runs.  The integration
+    # preloads it in the executor at setup
+    from asyncping3 import ping as _ping
+
+    return await _ping(host, timeout=timeout)
+
+
 class PingWatcherService:
-    def __init__(self, hass, config_entry, host):
-        self._hass = hass
-        self._config_entry = config_entry
+    """Watch a processor with pings, and call on_reconnect when it returns.
+
+    An interval of 0 disables the watcher.  While the processor is idle
+    the interval is stretched, as nothing is waiting on it.
+    """
+
+    IDLE_FACTOR = 5
+
+    def __init__(self, host, interval=60, on_reconnect=None, pinger=None, clock=None):
         self._host = host
-        self._stop = False
+        self._clock = clock or Clock()
+        self._interval = int(interval)
+        self._idle = False
+        self._on_reconnect = on_reconnect
+        self._ping = pinger or ping
+        self._stopped = asyncio.Event()
 
     async def start(self):
-        while not self._stop:
-            if int(self._config_entry.options.get(CONF_PING_INTERVAL)) == 0:
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            if self._interval == 0:
                 # Disable the listener
-                _LOGGER.info("Ping Watcher disabled.  Reload config to re-enable")
-                self._stop = True
+                _LOGGER.info("Ping Watcher disabled.  Set an interval to re-enable")
+                self._stopped.set()
                 break
             # Ping the AVR
-            _ping = await ping(self._host, timeout=4)
+            _ping = await self._ping(self._host, timeout=4)
             if not _ping:
                 # Pause and try again
-                await asyncio.sleep(2)
-                _ping = await ping(self._host, timeout=4)
+                await self._wait(2)
+                _ping = await self._ping(self._host, timeout=4)
             if _ping:
                 # Ping succeeded - wait and retry
-                await asyncio.sleep(
-                    int(self._config_entry.options.get(CONF_PING_INTERVAL, 60))
-                )
+                await self._wait(self.interval)
             else:
                 # Both attempts failed, so break
                 break
         # Ping failed, so wait until it succeeds again
-        if not self._stop:
+        if not self._stopped.is_set():
             _LOGGER.error(
                 "Connectivity lost to %s.  Waiting for availability.", self._host
             )
-        while not await ping(self._host, timeout=1) and not self._stop:
-            if int(self._config_entry.options.get(CONF_PING_INTERVAL)) == 0:
-                _LOGGER.info("Ping Watcher disabled.  Reload config to re-enable")
+        while not self._stopped.is_set() and not await self._ping(
+            self._host, timeout=1
+        ):
+            if self._interval == 0:
+                _LOGGER.info("Ping Watcher disabled.  Set an interval to re-enable")
                 # Disable the listener
-                self._stop = True
+                self._stopped.set()
                 break
             # Ping failed - wait and retry
-            await asyncio.sleep(
-                int(self._config_entry.options.get(CONF_PING_INTERVAL, 60))
-            )
+            await self._wait(self.interval)
         # Ping succeeded, so it's back, so reload
-        if not self._stop:
+        if not self._stopped.is_set():
             _LOGGER.error(
                 "Connectivity re-established with %s.  Reloading configuration",
                 self._host,
             )
-            await asyncio.sleep(30)
-            self._hass.config_entries.async_schedule_reload(self._config_entry.entry_id)
+            await self._wait(30)
+            if self._stopped.is_set():
+                return
+            if self._on_reconnect is not None:
+                self._on_reconnect()
+
+    async def _wait(self, seconds):
+        """Sleep for seconds, returning as soon as the watcher is stopped."""
+        try:
+            await self._clock.wait_for(self._stopped.wait(), seconds)
+        except TimeoutError:
+            pass
+
+    def set_host(self, host):
+        self._host = host
+
+    def set_interval(self, interval):
+        self._interval = int(interval)
+
+    def set_idle(self, idle):
+        self._idle = idle
+
+    @property
+    def interval(self):
+        return self._interval * self.IDLE_FACTOR if self._idle else self._interval
+
+    def set_reconnect_cb(self, cb):
+        self._on_reconnect = cb
 
     async def stop(self):
-        self._stop = True
+        self._stopped.set()
+
+
+class TaskSupervisor(object):
+    """Background work for a processor, with at most one task pending per kind.
+
+    Work scheduled while a task of the same kind is running is coalesced
+    into a single rerun once it finishes, so floods of notifications can't
+    pile up tasks.
+    """
+
+    def __init__(self, name, clock=None):
+        self._name = name
+        self._clock = clock or Clock()
+        self._tasks = {}
+        self._rerun = {}
+        self._closed = False
+        self.scheduled = 0
+        self.coalesced = 0
+
+    def schedule(self, kind, func):
+        """Run the coroutine function func in the background."""
+        if self._closed:
+            return
+        task = self._tasks.get(kind)
+        if task is not None and not task.done():
+            if kind in self._rerun:
+                self.coalesced += 1
+            self._rerun[kind] = func
+            return
+        self.scheduled += 1
+        task = self._clock.create_task(
+            func(), name="emotiva %s %s" % (self._name, kind)
+        )
+        self._tasks[kind] = task
+        task.add_done_callback(lambda t: self._task_done(kind, t))
+
+    def _task_done(self, kind, task):
+        if self._tasks.get(kind) is task:
+            del self._tasks[kind]
+        if not task.cancelled() and task.exception() is not None:
+            _LOGGER.warning(
+                "Error in %s task for %s: %s", kind, self._name, task.exception()
+            )
+        if (func := self._rerun.pop(kind, None)) is not None:
+            self.schedule(kind, func)
+
+    @property
+    def depth(self):
+        """Return the number of tasks running or waiting to rerun."""
+        return len(self._tasks) + len(self._rerun)
+
+    def cancel_all(self):
+        self._closed = True
+        self._rerun.clear()
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def diagnostics(self):
+        return {
+            "depth": self.depth,
+            "running": sorted(self._tasks),
+            "scheduled": self.scheduled,
+            "coalesced": self.coalesced,
+        }
 
 
 class EmotivaNotifiers(object):
     subscription: object
-    subscription_task: object
     command: object
-    command_task: object
 
 
-class EmotivaNotifier(object):
+class EmotivaNotifier(asyncio.DatagramProtocol):
+    """Shared UDP endpoint for all processors on a local port.
+
+    Datagrams received are dispatched to the callback registered for the
+    sending processor.  The command notifier is also used to send requests,
+    so that replies arrive on the same socket the requests were sent from.
+    """
+
     def __init__(self):
         self._devs = {}
+        self._error_cbs = {}
+        self._local_addr = None
+        self._transport = None
+        self._stopping = False
+        self._reconnect_task = None
+        self.capture = None
+        self.received = 0
+        self.dropped = {"unknown_sender": 0, "oversize": 0, "not_emotiva": 0}
 
     async def _async_start(self, local_ip, local_port):
         _LOGGER.debug("Starting Listener on %s:%d", local_ip, local_port)
+        self._local_addr = (local_ip, local_port)
+        self._stopping = False
+        await self._async_bind()
+
+    async def _async_bind(self):
+        loop = asyncio.get_running_loop()
         try:
-            stream = await asyncio_datagram.bind((local_ip, local_port))
-        except IOError as e:
-            _LOGGER.critical("Cannot bind to local socket %d: %s", e.errno, e.strerror)
-        except Exception:
-            _LOGGER.critical(
-                "Unknown error on binding to local socket %s", sys.exc_info()[0]
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: self, local_addr=self._local_addr
             )
+        except OSError as e:
+            _LOGGER.critical("Cannot bind to local socket %d: %s", e.errno, e.strerror)
+            raise
+
+    def connection_lost(self, exc):
+        self._transport = None
+        if self._stopping:
+            return
+        _LOGGER.warning(
+            "Listener on port %d lost (%s).  Reconnecting", self._local_addr[1], exc
+        )
+        self._reconnect_task = asyncio.get_running_loop().create_task(
+            self._async_bind()
+        )
 
-        self._stream = stream
-
-        while True and stream is not None:
-            data, remote_addr = await stream.recv()
-
+    def datagram_received(self, data, remote_addr):
+        # Anything on these ports which isn't from a registered processor is
+        # dropped here, before it is captured, logged or decoded
+        cb = self._devs.get(remote_addr[0])
+        if cb is None:
+            self.dropped["unknown_sender"] += 1
+            return
+        if len(data) > MAX_DATAGRAM_SIZE:
+            self.dropped["oversize"] += 1
+            return
+        if not is_notification(data):
+            self.dropped["not_emotiva"] += 1
+            return
+        self.received += 1
+
+        if self.capture is not None:
+            self.capture.record(DIRECTION_IN, remote_addr, data)
+
+        if _LOGGER.isEnabledFor(logging.DEBUG):
             _LOGGER.debug(
                 "Received notification from %s\n%s",
                 remote_addr[0],
-                data.decode() if isinstance(data, bytes) else data,
+                data.decode(errors="replace"),
             )
 
-            cb = self._devs[remote_addr[0]]
+        cb(data)
+
+    def error_received(self, exc):
+        # The socket is shared and unconnected, so the error can't be tied to a
+        # processor.  Let each of them know.
+        _LOGGER.debug("Error received on port %d: %s", self._local_addr[1], exc)
+        for cb in list(self._error_cbs.values()):
+            cb(exc)
 
-            cb(data)
+    async def async_send(self, data, remote_addr):
+        if self._transport is None or self._transport.is_closing():
+            _LOGGER.debug("Transport closed.  Attempting to reconnect")
+            await self._async_bind()
 
-            await asyncio.sleep(0.1)
+        if self.capture is not None:
+            self.capture.record(DIRECTION_OUT, remote_addr, data)
 
-    async def _async_register(self, callback, remote_ip):
+        try:
+            self._transport.sendto(data, remote_addr)
+        except OSError as e:
+            cb = self._error_cbs.get(remote_addr[0])
+            if cb is None:
+                raise
+            cb(e)
+
+    async def _async_register(self, callback, remote_ip, error_callback=None):
         _LOGGER.debug("Registering %s with listener", remote_ip)
 
         if remote_ip not in self._devs:
             self._devs[remote_ip] = callback
+            if error_callback is not None:
+                self._error_cbs[remote_ip] = error_callback
 
     async def _async_stop(self):
-        self._stream.close()
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._transport is not None:
+            self._transport.close()
 
     async def _async_unregister(self, remote_ip):
-        del self._devs[remote_ip]
+        self._devs.pop(remote_ip, None)
+        self._error_cbs.pop(remote_ip, None)
+
+    @property
+    def local_address(self):
+        return self._local_addr[0] if self._local_addr else None
+
+    def diagnostics(self):
+        return {
+            "address": self.local_address,
+            "port": self._local_addr[1] if self._local_addr else None,
+            "processors": len(self._devs),
+            "received": self.received,
+            "dropped": dict(self.dropped),
+        }
+
+
+class EmotivaTransponderListener(asyncio.DatagramProtocol):
+    """Passive listener on the discovery response port.
+
+    Records every transponder reply seen, including replies to pings sent
+    by other controllers, and passes them to the registered callbacks.
+    """
+
+    def __init__(self, clock=None):
+        # Public so that probes can time replies on the same clock
+        self.clock = clock or Clock()
+        self._transport = None
+        self._callbacks = []
+        # ip -> (transponder info, time last seen)
+        self.seen = {}
+
+    async def _async_start(self, local_ip="0.0.0.0"):
+        _LOGGER.debug("Starting transponder listener on %s", local_ip)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: self,
+            local_addr=(local_ip, Emotiva.DISCOVER_RESP_PORT),
+            allow_broadcast=True,
+        )
+
+    async def _async_stop(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def datagram_received(self, data, remote_addr):
+        resp = parse_response(data)
+        if resp is None or len(resp) == 0 or resp.find("control") is None:
+            return
+        self.seen[remote_addr[0]] = (parse_transponder(resp), self.clock.monotonic())
+        for cb in list(self._callbacks):
+            cb(remote_addr[0], resp)
+
+    def async_add_listener(self, cb):
+        """Call cb(ip, transponder_xml) for each reply.  Returns a remover."""
+        self._callbacks.append(cb)
+
+        def _remove():
+            self._callbacks.remove(cb)
+
+        return _remove
+
+    def ping(self, ip, version=3):
+        """Send an emotivaPing from the listener so the reply comes back to it."""
+        if self._transport is not None:
+            self._transport.sendto(
+                get_protocol(version).ping_request(), (ip, Emotiva.DISCOVER_REQ_PORT)
+            )
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_response):
+        self._on_response = on_response
+
+    def datagram_received(self, data, remote_addr):
+        self._on_response(remote_addr[0], data)
 
 
 class Emotiva(object):
-    XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>'.encode("utf-8")
+    """Session with one processor, independent of Home Assistant.
+
+    The UDP transport is set with set_notifiers(), and the optional state
+    store, event callback and reconnect callback by their setters, so the
+    integration is an adapter over this class.
+    """
+
+    XML_HEADER = XML_HEADER
     DISCOVER_REQ_PORT = 7000
     DISCOVER_RESP_PORT = 7001
 
+    # High-churn properties which can't change while the processor is off
+    IDLE_EVENTS = frozenset(
+        [
+            "audio_input",
+            "audio_bits",
+            "audio_bitstream",
+            "video_input",
+            "video_format",
+            "video_space",
+        ]
+    )
+
+    # Seconds to show an optimistic state before reverting if not confirmed
+    OPTIMISTIC_TIMEOUT = 3.0
+    # A sequence number this far behind the last one means the processor
+    # restarted its count, rather than a late notification
+    SEQUENCE_RESET = 100
+    # Missing sequence numbers remembered, to recognise late arrivals
+    SEQUENCE_MISSING_MAX = 64
+    # Properties which changed this recently are refreshed after a gap
+    RESYNC_WINDOW = 10.0
+    # A reported volume the ramp sent this recently, or in its last two steps,
+    # is its own notification arriving late rather than another change
+    RAMP_LATENCY = 1.0
+
     NOTIFY_EVENTS = set(
         [
             "power",
@@ -160,8 +455,6 @@ class Emotiva(object):
 
     def __init__(
         self,
-        hass,
-        config_entry,
         ip,
         transp_xml="",
         _ctrl_port=None,
@@ -172,9 +465,9 @@ class Emotiva(object):
         _info_port=None,
         _setup_port=None,
         events=NOTIFY_EVENTS,
+        clock=None,
     ):
-        self._hass = hass
-        self._config_entry = config_entry
+        self._clock = clock or Clock()
         self._ip = ip
         self._name = _name
         self._model = _model
@@ -183,54 +476,48 @@ class Emotiva(object):
         self._notify_port = _notify_port
         self._info_port = _info_port
         self._setup_port_tcp = _setup_port
-        self._volume_max = 11
-        self._volume_min = -96
-        self._volume_range = self._volume_max - self._volume_min
         self._ctrl_sock = None
-        self._udp_stream = None
+        self._send_errors = 0
+        self._command_stats = {"sent": 0, "suppressed": 0}
+        # optimistic values awaiting confirmation: key -> (confirmed, timer, sent)
+        self._pending = {}
+        # futures waiting for a command's state to be confirmed, by key
+        self._confirm_waiters = {}
         self._update_cb = None
         self._remote_update_cb = None
         self._sensor_update_cb = {}
-        self._all_events = set(
-            [
-                "power",
-                "source",
-                "dim",
-                "mode",
-                "speaker_preset",
-                "center",
-                "subwoofer",
-                "surround",
-                "back",
-                "volume",
-                "loudness",
-                "treble",
-                "bass",
-                "zone2_power",
-                "zone2_volume",
-                "zone2_input",
-                "tuner_band",
-                "tuner_channel",
-                "tuner_signal",
-                "tuner_program",
-                "tuner_RDS",
-                "audio_input",
-                "audio_bitstream",
-                "audio_bits",
-                "video_input",
-                "video_format",
-                "video_space",
-                "input_1",
-                "input_2",
-                "input_3",
-                "input_4",
-                "input_5",
-                "input_6",
-                "input_7",
-                "input_8",
-            ]
-        )
-        self.ping_watcher = PingWatcherService(self._hass, self._config_entry, ip)
+        self._select_update_cb = None
+        self._created = self._clock.monotonic()
+        self._subscribed_at = None
+        self._timing = {}
+        self._subscribed = set()
+        self._idle = False
+        # Set from leaving idle until the full refresh has been sent
+        self._resuming = False
+        self.ping_watcher = PingWatcherService(ip, clock=self._clock)
+        self._ping_task = None
+        self._shutdown = False
+        self._tasks = TaskSupervisor(self._ip, self._clock)
+        self._ramp_task = None
+        # (time sent, volume) for the ramp's recent steps, newest last
+        self._ramp_steps = deque()
+        self._event_cb = None
+        self._change_events = ChangeEvents(self._fire_event, clock=self._clock)
+        self._sequence = None
+        self._missing = set()
+        self._sequence_stats = {
+            "lost": 0,
+            "reordered": 0,
+            "duplicates": 0,
+            "resets": 0,
+            "resyncs": 0,
+        }
+        # property -> time it last changed
+        self._changed_at = {}
+        self._resync_events = set()
+        self._ramp_stats = {"started": 0, "completed": 0, "cancelled": 0}
+        self._power_stats = {"refreshes_skipped": 0, "resumes": 0}
+        self._history = History()
 
         if not self._ctrl_port or not self._notify_port:
             self.__parse_transponder(transp_xml)
@@ -238,95 +525,32 @@ class Emotiva(object):
         if not self._ctrl_port or not self._notify_port:
             raise InvalidTransponderResponseError("Coulnd't find ctrl/notify ports")
 
-        self._stripped_model = (
-            self._model.replace(" ", "").replace("-", "").replace("_", "").upper()[:4]
+        self._protocol = get_protocol(self._proto_ver)
+        _LOGGER.debug("Using %s for %s", self._protocol, self._ip)
+
+        self._profile = get_profile(self._model)
+        _LOGGER.debug("Using %s profile for %s", self._profile.name, self._model)
+        self._mode_properties = self._profile.mode_properties
+        # Per device overlay on the profile: the mode properties the processor
+        # reports as visible, and the labels it reports for its inputs
+        self._visible_modes = set()
+        self._source_labels = {}
+        # Inputs the processor reports as not visible
+        self._hidden_sources = set()
+        # source list and label -> command, rebuilt when the overlay changes
+        self._sources = None
+        self._source_keys = None
+        self._volume_curve = VolumeCurve(
+            self._profile.volume_min, self._profile.volume_max
         )
-        _LOGGER.debug("Stripped Model %s", self._stripped_model)
-        match self._stripped_model:
-            # mode : command,mode_name_string, visible
-            case "XMC1":
-                _LOGGER.debug("Sound Modes for XMC-1")
-                self._modes = {
-                    "Stereo": ["stereo", "mode_stereo", False],
-                    "Direct": ["direct", "mode_direct", False],
-                    "Dolby": ["dolby", "mode_dolby", False],
-                    "DTS": ["dts", "mode_dts", False],
-                    "All Stereo": ["all_stereo", "mode_all_stereo", False],
-                    "Auto": ["auto", "mode_auto", False],
-                    "Reference Stereo": ["reference_stereo", "mode_ref_stereo", False],
-                    "Surround": ["surround_mode", "mode_surround", False],
-                    "PLIIx Music": ["dolby", "mode_dolby", False],
-                    "PLIIx Movie": ["dolby", "mode_dolby", False],
-                    "dts Neo:6 Cinema": ["dts", "mode_dts", False],
-                    "dts Neo:6 Music": ["dts", "mode_dts", False],
-                }
-            case "XMC2":
-                _LOGGER.debug("Sound Modes for XMC-2")
-                self._modes = {
-                    "Stereo": ["stereo", "mode_stereo", False],
-                    "Direct": ["direct", "mode_direct", False],
-                    "Dolby": ["dolby", "mode_dolby", False],
-                    "DTS": ["dts", "mode_dts", False],
-                    "All Stereo": ["all_stereo", "mode_all_stereo", False],
-                    "Auto": ["auto", "mode_auto", False],
-                    "Reference Stereo": ["reference_stereo", "mode_ref_stereo", False],
-                    "Surround": ["surround_mode", "mode_surround", False],
-                    "Dolby ATMOS": ["dolby", "mode_dolby", False],
-                    "dts Neural:X": ["dts", "mode_dts", False],
-                    "Dolby Surround": ["dolby", "mode_dolby", False],
-                }
-            case "RMC1":
-                _LOGGER.debug("Sound Modes for RMC-1")
-                self._modes = {
-                    "Stereo": ["stereo", "mode_stereo", False],
-                    "Direct": ["direct", "mode_direct", False],
-                    "Dolby": ["dolby", "mode_dolby", False],
-                    "DTS": ["dts", "mode_dts", False],
-                    "All Stereo": ["all_stereo", "mode_all_stereo", False],
-                    "Auto": ["auto", "mode_auto", False],
-                    "Reference Stereo": ["reference_stereo", "mode_ref_stereo", False],
-                    "Surround": ["surround_mode", "mode_surround", False],
-                    "Dolby Surround": ["dolby", "mode_dolby", False],
-                    "Dolby ATMOS": ["dolby", "mode_dolby", False],
-                    "dts Neural:X": ["dts", "mode_dts", False],
-                }
-            case "RMC1l":
-                _LOGGER.debug("Sound Modes for RMC-1l")
-                self._modes = {
-                    "Stereo": ["stereo", "mode_stereo", False],
-                    "Direct": ["direct", "mode_direct", False],
-                    "Dolby": ["dolby", "mode_dolby", False],
-                    "DTS": ["dts", "mode_dts", False],
-                    "All Stereo": ["all_stereo", "mode_all_stereo", False],
-                    "Auto": ["auto", "mode_auto", False],
-                    "Reference Stereo": ["reference_stereo", "mode_ref_stereo", False],
-                    "Surround": ["surround_mode", "mode_surround", False],
-                    "Dolby Surround": ["dolby", "mode_dolby", False],
-                    "Dolby ATMOS": ["dolby", "mode_dolby", False],
-                    "dts Neural:X": ["dts", "mode_dts", False],
-                }
-            case _:
-                _LOGGER.debug("Sound Modes Default")
-                self._modes = {
-                    "Stereo": ["stereo", "mode_stereo", False],
-                    "Direct": ["direct", "mode_direct", False],
-                    "Dolby": ["dolby", "mode_dolby", False],
-                    "DTS": ["dts", "mode_dts", False],
-                    "All Stereo": ["all_stereo", "mode_all_stereo", False],
-                    "Auto": ["auto", "mode_auto", False],
-                    "Reference Stereo": ["reference_stereo", "mode_ref_stereo", False],
-                    "Surround": ["surround_mode", "mode_surround", False],
-                    "PLIIx Music": ["dolby", "mode_dolby", False],
-                    "PLIIx Movie": ["dolby", "mode_dolby", False],
-                    "dts Neo:6 Cinema": ["dts", "mode_dts", False],
-                    "dts Neo:6 Music": ["dts", "mode_dts", False],
-                }
 
         self._events = events
 
         # current state
         self._current_state = dict(((ev, None) for ev in self._events))
-        self._current_state.update(dict(((m[1], None) for m in self._modes.values())))
+        self._current_state.update(
+            (mode.property, None) for mode in self._profile.modes.values()
+        )
         # Add states for the initial music modes
         self._current_state.update(
             {
@@ -343,54 +567,62 @@ class Emotiva(object):
                 "mode_ref_stereo": "Reference Stereo",
             }
         )
-        self._sources = {
-            "source_1": "Input 1",
-            "source_2": "Input 2",
-            "source_3": "Input 3",
-            "source_4": "Input 4",
-            "source_5": "Input 5",
-            "source_6": "Input 6",
-            "source_7": "Input 7",
-            "source_8": "Input 8",
-            "analog1": "Analog 1",
-            "analog2": "Analog 2",
-            "analog3": "Analog 3",
-            "analog4": "Record In",
-            "analog5": "Analog 5",
-            "analog71": "Analog 7.1",
-            "ARC": "HDMI ARC",
-            "coax1": "Coax 1",
-            "coax2": "Coax 2",
-            "coax3": "Coax 3",
-            "coax4": "AES/EBU",
-            "hdmi1": "HDMI 1",
-            "hdmi2": "HDMI 2",
-            "hdmi3": "HDMI 3",
-            "hdmi4": "HDMI 4",
-            "hdmi5": "HDMI 5",
-            "hdmi6": "HDMI 6",
-            "hdmi7": "HDMI 7",
-            "hdmi8": "HDMI 8",
-            "optical1": "Optical 1",
-            "optical2": "Optical 2",
-            "optical3": "Optical 3",
-            "optical4": "Optical 4",
-            "source_tuner": "Tuner",
-            "usb_stream": "USB Stream",
-        }
-
         self._muted = False
 
-        self._local_ip = self._get_local_ip()
+        self._store = None
+        self._notifiers = None
+
+    def set_store(self, store):
+        """Set where state is saved: an object with async_load() and async_delay_save()."""
+        self._store = store
 
-    def _get_local_ip(self):
-        #        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        #        sock.connect((self._ip, self._ctrl_port))
-        #        _local_ip = sock.getsockname()[0]
-        #        sock.close()
-        #        return _local_ip
-        _LOGGER.debug("Local IP: %s", self._hass.config.api.local_ip)
-        return self._hass.config.api.local_ip
+    async def async_restore_state(self):
+        """Restore the last known state saved by a previous run."""
+        if self._store is None:
+            return
+        try:
+            data = await self._store.async_load()
+        except Exception:
+            _LOGGER.warning("Unable to load saved state for %s", self._name)
+            return
+        if not data:
+            return
+        _LOGGER.debug("Restoring saved state for %s", self._name)
+        for key, val in data.get("state", {}).items():
+            if key in self._current_state and val is not None:
+                self._current_state[key] = val
+        self._muted = data.get("muted", False)
+        defaults = dict(self._profile.sources)
+        for key, val in data.get("sources", {}).items():
+            if key in defaults and val != defaults[key]:
+                self._source_labels[key] = val
+        for mode, visible in data.get("modes", {}).items():
+            if visible and mode in self._profile.modes:
+                self._visible_modes.add(self._profile.modes[mode].property)
+        self._hidden_sources = set(data.get("hidden_sources", ())) & defaults.keys()
+        self._invalidate_sources()
+        # The processor will most likely confirm the restored power state, which
+        # isn't a change, so start out idle if it was off
+        self._update_idle()
+
+    def _async_schedule_save(self):
+        if self._store is not None:
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def _data_to_save(self):
+        return {
+            "state": self._current_state,
+            "muted": self._muted,
+            "sources": {
+                key: self._source_labels.get(key, label)
+                for key, label in self._profile.sources
+            },
+            "modes": {
+                mode: v.property in self._visible_modes
+                for mode, v in self._profile.modes.items()
+            },
+            "hidden_sources": sorted(self._hidden_sources),
+        }
 
     def connect(self):
         self._ctrl_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -399,61 +631,220 @@ class Emotiva(object):
 
     async def register_with_notifier(self):
         await self._notifiers.subscription._async_register(
-            self._notify_handler, self._ip
+            self._notify_handler, self._ip, self._error_handler
+        )
+        await self._notifiers.command._async_register(
+            self._notify_handler, self._ip, self._error_handler
         )
-        await self._notifiers.command._async_register(self._notify_handler, self._ip)
 
     async def unregister_from_notifier(self):
         _LOGGER.debug("Removing %s from Listeners", self._ip)
         await self._notifiers.subscription._async_unregister(self._ip)
         await self._notifiers.command._async_unregister(self._ip)
 
+    async def async_set_address(self, ip, notifiers=None):
+        """Move the session to the processor's new address.
+
+        Pass notifiers if the new address is reached through another local
+        address.
+        """
+        _LOGGER.warning("%s has moved from %s to %s", self._name, self._ip, ip)
+        await self.unregister_from_notifier()
+        self._ip = ip
+        if notifiers is not None:
+            self._notifiers = notifiers
+        self.ping_watcher.set_host(ip)
+        await self.register_with_notifier()
+        self._subscribed = set()
+        await self.async_subscribe_events()
+
     async def async_subscribe_events(self):
         _LOGGER.debug("Subscribing to %s", self._events)
-        await self._subscribe_events(self._events)
+        self._subscribed = set(self._wanted_events())
+        # A new subscription may start a new sequence
+        self._sequence = None
+        self._missing.clear()
+        await self._subscribe_events(self._subscribed)
+        if "subscription" not in self._timing:
+            self._subscribed_at = self._clock.monotonic()
+            self._timing["subscription"] = round(self._subscribed_at - self._created, 3)
 
     async def async_unsubscribe_events(self):
-        _LOGGER.debug("Unsubscribing from %s", self._events)
-        await self._unsubscribe_events(self._all_events)
-        await asyncio.sleep(0.5)
+        _LOGGER.debug("Unsubscribing from %s", self._subscribed)
+        if self._subscribed:
+            await self._unsubscribe_events(self._subscribed)
+            self._subscribed = set()
+
+    def set_events(self, events):
+        """Set the notifications to track without changing the subscription."""
+        self._events = set(events)
+        for ev in self._events:
+            self._current_state.setdefault(ev, None)
+
+    async def async_set_events(self, events):
+        """Change the notifications tracked, subscribing only to the changes."""
+        self.set_events(events)
+        await self._async_sync_subscriptions()
+        self._notify_update_cbs()
+
+    def _wanted_events(self):
+        if self._idle:
+            return self._events - self.IDLE_EVENTS
+        return self._events
+
+    async def _async_sync_subscriptions(self):
+        if not self._subscribed:
+            # Not subscribed yet, so the full subscription will pick them up
+            return
+        wanted = self._wanted_events()
+        removed = self._subscribed - wanted
+        added = wanted - self._subscribed
+        if removed:
+            _LOGGER.debug("Unsubscribing from %s", removed)
+            await self._unsubscribe_events(removed)
+            self._subscribed -= removed
+        if added:
+            _LOGGER.debug("Subscribing to %s", added)
+            await self._subscribe_events(added)
+            self._subscribed |= added
+
+    def _update_idle(self):
+        # Idle while neither zone is powered on
+        idle = (
+            self._current_state.get("power") == "Off"
+            and self._current_state.get("zone2_power") != "On"
+        )
+        if idle != self._idle:
+            _LOGGER.debug("%s %s idle", self._name, "entering" if idle else "leaving")
+            self._idle = idle
+            self.ping_watcher.set_idle(idle)
+            if idle:
+                self.cancel_volume_ramp()
+                self._tasks.schedule("subscriptions", self._async_sync_subscriptions)
+            else:
+                self._resuming = True
+                self._tasks.schedule("subscriptions", self._async_resume)
 
-    def _notify_handler(self, data):
+    async def _async_resume(self):
+        """Resubscribe after standby and refresh everything in one request."""
+        try:
+            await self._async_sync_subscriptions()
+            if self._subscribed:
+                self._power_stats["resumes"] += 1
+                await self._update_events(sorted(self._subscribed))
+        finally:
+            self._resuming = False
+
+    def _notify_handler(self, data, check_sequence=True):
         _LOGGER.debug("Notify Handler called.")
-        _decoded_data = data.decode("utf-8")
-        if "emotivaUnsubscribe" not in _decoded_data:
+        if b"emotivaUnsubscribe" not in data:
             resp = self._parse_response(data)
+            if check_sequence and not self._check_sequence(resp):
+                return
             self._handle_status(resp)
 
-        async def _update_sensors():
-            # await asyncio.sleep(1.0)
-            await self._update_sensor_values()
+        if b"emotivaUpdate" not in data and b"audio_input" not in data:
+            if self._idle or self._resuming:
+                # The signal properties can't change in standby, and on resume
+                # they are refreshed along with everything else
+                self._power_stats["refreshes_skipped"] += 1
+            else:
+                _LOGGER.debug("Sensor Update Scheduled")
+                self._tasks.schedule("sensor_update", self._update_sensor_values)
 
-        if "emotivaUpdate" not in _decoded_data and "audio_input" not in _decoded_data:
-            _LOGGER.debug("Sensor Update Scheduled")
-            self._hass.async_create_task(_update_sensors())
+    def _check_sequence(self, resp):
+        """Return whether a notification is newer than those already applied."""
+        seq = self._protocol.sequence(resp)
+        if seq is None:
+            return True
+        last = self._sequence
+        if last is None or seq == last + 1:
+            self._sequence = seq
+            return True
 
-    async def _subscribe_events(self, events):
-        msg = self.format_request(
-            "emotivaSubscription",
-            [(ev, None) for ev in events],
-            {"protocol": "3.0"} if self._proto_ver == 3.0 else {},
+        if seq > last:
+            missed = range(last + 1, seq)
+            _LOGGER.debug(
+                "%s missed notifications %d to %d", self._name, last + 1, seq - 1
+            )
+            self._sequence_stats["lost"] += len(missed)
+            self._missing.update(missed[-self.SEQUENCE_MISSING_MAX :])
+            while len(self._missing) > self.SEQUENCE_MISSING_MAX:
+                self._missing.remove(min(self._missing))
+            self._sequence = seq
+            self._request_resync()
+            return True
+
+        if last - seq > self.SEQUENCE_RESET:
+            _LOGGER.debug("%s restarted its sequence at %d", self._name, seq)
+            self._sequence_stats["resets"] += 1
+            self._sequence = seq
+            self._missing.clear()
+            return True
+
+        # Older than what has been applied, so any values in it are stale
+        if seq in self._missing:
+            self._missing.remove(seq)
+            self._sequence_stats["lost"] -= 1
+            self._sequence_stats["reordered"] += 1
+            _LOGGER.debug("%s discarding late notification %d", self._name, seq)
+        else:
+            self._sequence_stats["duplicates"] += 1
+            _LOGGER.debug("%s discarding repeated notification %d", self._name, seq)
+        return False
+
+    def _request_resync(self):
+        # The lost notification most likely carried properties which are
+        # changing, or which a command is waiting on
+        now = self._clock.monotonic()
+        events = {
+            name
+            for name, at in self._changed_at.items()
+            if now - at < self.RESYNC_WINDOW
+        }
+        events.update("volume" if key == "mute" else key for key in self._pending)
+        events &= self._subscribed
+        self._resync_events |= events or self._subscribed or self._events
+        self._tasks.schedule("resync", self._async_resync)
+
+    async def _async_resync(self):
+        events, self._resync_events = self._resync_events, set()
+        if not events:
+            return
+        _LOGGER.debug("%s refreshing %s after lost notifications", self._name, events)
+        self._sequence_stats["resyncs"] += 1
+        await self._update_events(sorted(events))
+
+    async def async_replay_capture(self, records, speed=1.0, address=None):
+        """Feed captured notifications through the handler.
+
+        With address, only those received from it are replayed.  Captures
+        attached to bug reports come from other networks, so by default every
+        notification is.
+        """
+        return await async_replay(
+            records, self._replay_handler, speed, address, self._clock
         )
+
+    def _replay_handler(self, data):
+        # Captured sequence numbers are from another session, so they mustn't
+        # be checked against, or disturb, the live sequence
+        self._notify_handler(data, check_sequence=False)
+
+    def _error_handler(self, exc):
+        self._send_errors += 1
+        _LOGGER.warning("Error communicating with %s: %s", self._ip, exc)
+
+    async def _subscribe_events(self, events):
+        msg = self._protocol.subscribe_request(events)
         await self._async_send_request(msg, ack=True)
 
     async def _unsubscribe_events(self, events):
-        msg = self.format_request(
-            "emotivaUnsubscribe",
-            [(ev, None) for ev in events],
-            {"protocol": "3.0"} if self._proto_ver == 3.0 else {},
-        )
+        msg = self._protocol.unsubscribe_request(events)
         await self._async_send_request(msg, ack=True)
 
     async def _update_events(self, events):
-        msg = self.format_request(
-            "emotivaUpdate",
-            [(ev, {}) for ev in events],
-            {"protocol": "3.0"} if self._proto_ver == 3 else {},
-        )
+        msg = self._protocol.update_request(events)
         await self._async_send_request(msg, ack=True)
 
     async def _update_sensor_values(self):
@@ -472,151 +863,312 @@ class Emotiva(object):
     async def async_update_status(self, events):
         await self._update_events(events)
 
-    async def udp_connect(self):
-        try:
-            #            self._udp_stream = await asyncio_datagram.connect(
-            #                (self._ip, self._ctrl_port), (self._local_ip, self._ctrl_port)
-            #            )
-            self._udp_stream = await asyncio_datagram.connect(
-                (self._ip, self._ctrl_port)
-            )
-        except IOError as e:
-            _LOGGER.critical(
-                "Cannot connect control listener socket %d: %s", e.errno, e.strerror
-            )
-        except Exception:
-            _LOGGER.critical(
-                "Unknown error on control listener socket connection %s",
-                sys.exc_info()[0],
-            )
-
-    async def udp_disconnect(self):
+    async def _udp_client(self, req, ack):
         try:
-            self._udp_stream.close()
-        except IOError as e:
+            await self._notifiers.command.async_send(req, (self._ip, self._ctrl_port))
+        except OSError as e:
             _LOGGER.critical(
-                "Cannot disconnect from control listener socket %d: %s",
+                "Cannot send to %s on command socket %d: %s",
+                self._ip,
                 e.errno,
                 e.strerror,
             )
-        except Exception:
-            _LOGGER.critical(
-                "Unknown error on control listener socket disconnection %s",
-                sys.exc_info()[0],
-            )
 
-    async def _udp_client(self, req, ack):
-        try:
-            await self._udp_stream.send(req)
-        except Exception:
-            try:
-                _LOGGER.debug("Connection lost.  Attepting to reconnect")
-                self.udp_connect()
-                await self._udp_stream.send(req)
+    async def _async_send_request(self, req, ack=False, process_response=True):
+        await self._udp_client(req, ack)
+
+        # _LOGGER.debug("_async_send_request received %s", self._resp)
+
+        # if ack and process_response:
+        #    resp = self._parse_response(self._resp)
+        #    self._handle_status(resp)
+
+    def _get_state(self, key):
+        if key == "mute":
+            return self._muted
+        return self._current_state[key]
 
-            except IOError as e:
-                _LOGGER.critical(
-                    "Cannot reconnect to command socket %d: %s", e.errno, e.strerror
+    def _set_state(self, key, value):
+        if key == "mute":
+            self._muted = value
+        else:
+            self._current_state[key] = value
+
+    def _set_optimistic(self, key, value):
+        """Show value until the processor confirms it, or roll it back."""
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            confirmed = pending[0]
+            pending[1].cancel()
+        else:
+            confirmed = self._get_state(key)
+        timer = self._clock.call_later(self.OPTIMISTIC_TIMEOUT, self._rollback, key)
+        self._pending[key] = (confirmed, timer, self._clock.monotonic())
+        self._set_state(key, value)
+        self._notify_update_cbs()
+
+    def _confirm(self, name, val):
+        """Settle the optimistic values a notification reports.
+
+        A value the processor reports as something else isn't confirmed, and
+        the reported value replaces it.
+        """
+        if name == "volume":
+            reported = {"mute": val == "Mute"}
+            if val != "Mute":
+                reported["volume"] = val
+        else:
+            reported = {name: val}
+        for key, value in reported.items():
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                continue
+            pending[1].cancel()
+            confirmed = self._same_state(key, self._get_state(key), value)
+            self._release_waiters(key, confirmed)
+            if confirmed:
+                self._history.record(
+                    self._clock.time(),
+                    KIND_LATENCY,
+                    key,
+                    round(self._clock.monotonic() - pending[2], 4),
                 )
-            except Exception:
-                _LOGGER.critical(
-                    "Unknown error on command socket reconnection %s", sys.exc_info()[0]
+            else:
+                _LOGGER.debug(
+                    "%s reported %s as %s rather than %s",
+                    self._ip,
+                    key,
+                    value,
+                    self._get_state(key),
                 )
 
-        # await _stream.send(command, (self._ip, self._ctrl_port))
-        # if ack:
-        #    resp, remote_addr = await self._udp_stream.recv()
-        #    _LOGGER.debug(
-        #        "_udp_client received: \n%s",
-        #        resp.decode() if isinstance(resp, bytes) else resp,
-        #    )
-        # else:
-        #    resp = None
+    @staticmethod
+    def _same_state(key, shown, reported):
+        if key != "volume":
+            return shown == reported
+        try:
+            shown, reported = (
+                VolumeCurve.quantise(float(db.replace(" ", "")))
+                for db in (shown, reported)
+            )
+        except (AttributeError, ValueError):
+            return False
+        return shown == reported
+
+    def _rollback(self, key):
+        confirmed = self._pending.pop(key)[0]
+        self._release_waiters(key, False)
+        _LOGGER.debug(
+            "No confirmation of %s from %s.  Reverting to %s", key, self._ip, confirmed
+        )
+        self._set_state(key, confirmed)
+        self._notify_update_cbs()
 
-        # _stream.close()
+    def _release_waiters(self, key, confirmed):
+        for waiter in self._confirm_waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.set_result(confirmed)
 
-        resp = None
-        self._resp = resp
+    async def async_command(self, command, value="0"):
+        """Send a command and wait for the processor to confirm any state it sets.
 
-    async def _async_send_request(self, req, ack=False, process_response=True):
-        await self._udp_client(req, ack)
+        Returns a dict of whether the command was sent, whether its state was
+        confirmed, and the seconds taken to confirm it or to send it.
+        """
+        loop = asyncio.get_running_loop()
+        started = self._clock.monotonic()
+        key, setter = {
+            "power_on": ("power", self.async_turn_on),
+            "power_off": ("power", self.async_turn_off),
+            "mute_on": ("mute", lambda: self.async_set_mute(True)),
+            "mute_off": ("mute", lambda: self.async_set_mute(False)),
+        }.get(command, (None, None))
+        if key is None:
+            await self.async_send_command(command, value)
+            return {
+                "sent": True,
+                "confirmed": None,
+                "latency": round(self._clock.monotonic() - started, 4),
+            }
 
-        # _LOGGER.debug("_async_send_request received %s", self._resp)
+        sent = self._command_stats["sent"]
+        waiter = loop.create_future()
+        self._confirm_waiters.setdefault(key, []).append(waiter)
+        try:
+            await setter()
+            if self._command_stats["sent"] == sent:
+                # Already in the requested state
+                return {"sent": False, "confirmed": True, "latency": 0.0}
+            confirmed = await self._clock.wait_for(waiter, self.OPTIMISTIC_TIMEOUT + 1)
+        except TimeoutError:
+            confirmed = False
+        finally:
+            waiters = self._confirm_waiters.get(key, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+        return {
+            "sent": True,
+            "confirmed": confirmed,
+            "latency": (
+                round(self._clock.monotonic() - started, 4) if confirmed else None
+            ),
+        }
 
-        # if ack and process_response:
-        #    resp = self._parse_response(self._resp)
-        #    self._handle_status(resp)
+    def query_history(self, kind=None, name=None, since=None, limit=None):
+        """Return recent property changes, commands and latencies, oldest first."""
+        return self._history.query(kind, name, since, limit)
+
+    @property
+    def pending(self):
+        """Return the states shown which the processor hasn't yet confirmed."""
+        return tuple(self._pending)
+
+    def _unchanged(self, key, value):
+        """Return whether the processor has confirmed that key is already value.
+
+        A value still awaiting confirmation isn't trusted, so a command which
+        repeats or reverses it is always sent.
+        """
+        return key not in self._pending and self._get_state(key) == value
+
+    def _suppressed(self, what, value):
+        self._command_stats["suppressed"] += 1
+        _LOGGER.debug("%s is already %s.  Not sending command", what, value)
 
     async def _async_send_emotivacontrol(self, command, value):
-        msg = self.format_request(
-            "emotivaControl",
-            [(command, {"value": str(value), "ack": "no"})],
-            {"protocol": "3.0"} if self._proto_ver == 3 else {},
-        )
+        self._command_stats["sent"] += 1
+        self._history.record(self._clock.time(), KIND_COMMAND, command, str(value))
+        msg = self._protocol.control_request(command, value)
         await self._async_send_request(msg, ack=True, process_response=False)
 
     def __parse_transponder(self, transp_xml):
-        # _LOGGER.debug("transp_xml %s", transp_xml)
-        elem = transp_xml.find("name")
-        if elem is not None:
-            self._name = elem.text.strip()
-        elem = transp_xml.find("model")
-        if elem is not None:
-            self._model = elem.text.strip()
-
-        ctrl = transp_xml.find("control")
-        elem = ctrl.find("version")
-        if elem is not None:
-            self._proto_ver = float(elem.text)
-        elem = ctrl.find("controlPort")
-        if elem is not None:
-            self._ctrl_port = int(elem.text)
-        elem = ctrl.find("notifyPort")
-        if elem is not None:
-            self._notify_port = int(elem.text)
-        elem = ctrl.find("infoPort")
-        if elem is not None:
-            self._info_port = int(elem.text)
-        elem = ctrl.find("setupPortTCP")
-        if elem is not None:
-            self._setup_port_tcp = int(elem.text)
+        info = parse_transponder(transp_xml)
+        self._name = info.get("name", self._name)
+        self._model = info.get("model", self._model)
+        self._proto_ver = info.get("version", self._proto_ver)
+        self._ctrl_port = info.get("control_port", self._ctrl_port)
+        self._notify_port = info.get("notify_port", self._notify_port)
+        self._info_port = info.get("info_port", self._info_port)
+        self._setup_port_tcp = info.get("setup_port", self._setup_port_tcp)
 
     def _handle_status(self, resp):
         _LOGGER.debug("_handle_status called")
-        for elem in resp:
-            if elem.tag == "property":
-                # v3 protocol style response, convert it to v2 style
-                # _LOGGER.debug("Handling Protocol V3 xml")
-                elem.tag = elem.get("name")
-            if elem.tag not in self._current_state:
-                _LOGGER.debug("Unknown element: %s" % elem.tag)
+        if "first_state" not in self._timing and self._subscribed_at is not None:
+            self._timing["first_state"] = round(
+                self._clock.monotonic() - self._subscribed_at, 3
+            )
+        changed = False
+        for name, val, visible in self._protocol.iter_properties(resp):
+            if name not in self._current_state:
+                _LOGGER.debug("Unknown element: %s" % name)
                 continue
-            val = (elem.get("value") or "").strip()
-            visible = (elem.get("visible") or "").strip()
+            if self._pending:
+                self._confirm(name, val)
             # update mode status
-            if elem.tag.startswith("mode_"):
-                for v in self._modes.items():
-                    if v[1][1] == elem.tag and v[1][2] != visible:
-                        v[1][2] = True if visible == "true" else False
-                        _LOGGER.debug(
-                            " Changing visibility of %s to %s", elem.tag, visible
-                        )
-                        self._modes.update({v[0]: v[1]})
-            # do not
-            if elem.tag.startswith("input_") and visible != "true":
-                continue
-            if elem.tag == "volume":
+            if name in self._mode_properties:
+                _visible = visible == "true"
+                if (name in self._visible_modes) != _visible:
+                    if _visible:
+                        self._visible_modes.add(name)
+                    else:
+                        self._visible_modes.discard(name)
+                    changed = True
+                    _LOGGER.debug(" Changing visibility of %s to %s", name, visible)
+            if name.startswith("input_"):
+                if self._update_input(name, val, visible == "true"):
+                    changed = True
+                if visible != "true":
+                    continue
+            if name == "volume":
+                if self._ramp_task is not None and not self._from_ramp(val):
+                    # Changed on the remote or front panel
+                    self.cancel_volume_ramp()
                 if val == "Mute":
-                    self._muted = True
+                    if not self._muted:
+                        self._muted = True
+                        self._changed_at[name] = self._clock.monotonic()
+                        self._history.record(
+                            self._clock.time(), KIND_PROPERTY, name, val
+                        )
+                        changed = True
                     continue
+                changed = changed or self._muted
                 self._muted = False
                 # fall through
-            if val:
-                self._current_state[elem.tag] = val
-            if elem.tag.startswith("input_"):
-                num = elem.tag[6:]
-                self._sources["source_" + num] = val
+            if val and self._current_state[name] != val:
+                self._current_state[name] = val
+                self._changed_at[name] = self._clock.monotonic()
+                self._history.record(self._clock.time(), KIND_PROPERTY, name, val)
+                changed = True
+            if name in EVENT_TYPES:
+                self._change_events.update(name, val)
+
+        if changed:
+            self._async_schedule_save()
+        # Also when nothing changed, as an optimistic or restored power state
+        # being confirmed isn't a change
+        self._update_idle()
+
+        self._notify_update_cbs()
+
+    def _from_ramp(self, val):
+        """Return whether a reported volume is one the ramp sent."""
+        if val == "Mute":
+            return False
+        try:
+            db = VolumeCurve.quantise(float(val.replace(" ", "")))
+        except ValueError:
+            return True
+        return any(db == step for _sent, step in self._ramp_steps)
+
+    def _add_ramp_step(self, db):
+        now = self._clock.monotonic()
+        self._ramp_steps.append((now, db))
+        while (
+            len(self._ramp_steps) > 2
+            and now - self._ramp_steps[0][0] > self.RAMP_LATENCY
+        ):
+            self._ramp_steps.popleft()
+
+    def _update_input(self, name, label, visible):
+        """Apply an input's label and visibility, returning whether either changed."""
+        key = "source_" + name[6:]
+        if visible:
+            if key not in self._hidden_sources and (
+                not label or self._source_labels.get(key) == label
+            ):
+                return False
+            self._hidden_sources.discard(key)
+            if label:
+                self._source_labels[key] = label
+        else:
+            if key in self._hidden_sources:
+                return False
+            self._hidden_sources.add(key)
+        self._invalidate_sources()
+        return True
+
+    def _invalidate_sources(self):
+        self._sources = None
+        self._source_keys = None
+
+    def _build_sources(self):
+        self._source_keys = {
+            self._source_labels.get(key, label): key
+            for key, label in self._profile.sources
+            if key not in self._hidden_sources
+        }
+        self._sources = tuple(self._source_keys)
 
+    def set_event_cb(self, cb):
+        """Set cb(event_type, data) to be called for input and format changes."""
+        self._event_cb = cb
+
+    def _fire_event(self, event_type, data):
+        if self._event_cb is not None:
+            self._event_cb(event_type, {"name": self._name, **data})
+
+    def _notify_update_cbs(self):
         if self._update_cb:
             self._update_cb()
         if self._remote_update_cb:
@@ -646,65 +1198,138 @@ class Emotiva(object):
         _LOGGER.debug("Setting up Ping Watcher")
         await self.ping_watcher.start()
 
+    def start_ping_watcher(self):
+        """Start the ping watcher unless it's already running."""
+        if self._ping_task is not None and not self._ping_task.done():
+            return
+        self._ping_task = self._clock.create_task(
+            self.run_ping_watcher(), name="emotiva ping watcher task"
+        )
+
     async def stop_ping_watcher(self):
         _LOGGER.debug("Stopping Ping Watcher")
         await self.ping_watcher.stop()
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            self._ping_task = None
+
+    async def async_shutdown(self):
+        """Stop all activity for the processor, for unload or shutdown."""
+        if self._shutdown:
+            return
+        self._shutdown = True
+        self._tasks.cancel_all()
+        self.cancel_volume_ramp()
+        self._change_events.cancel()
+        for key, pending in self._pending.items():
+            pending[1].cancel()
+            self._release_waiters(key, False)
+        self._pending.clear()
+        self.set_update_cb(None)
+        await self.stop_ping_watcher()
+        try:
+            await self.async_unsubscribe_events()
+        finally:
+            await self.unregister_from_notifier()
 
     @classmethod
-    def discover(cls, version=2):
-        resp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            resp_sock.bind(("", cls.DISCOVER_RESP_PORT))
-        except Exception:
-            time.sleep(1)
+    async def async_discover(
+        cls,
+        hosts=None,
+        timeout=DISCOVERY_TIMEOUT,
+        version=3,
+        listener=None,
+        broadcasts=None,
+        clock=None,
+    ):
+        """Find processors and return (ip, transponder xml) for each.
+
+        Without hosts, an emotivaPing is broadcast to each of the broadcast
+        addresses, by default the limited broadcast address, at once and
+        every reply within the timeout is returned.  With hosts, each is
+        pinged directly and the search ends as soon as they have all replied.
+        If a transponder listener is running it holds the response port, so
+        pass it in to search through it.  The timeout runs on clock, by
+        default the listener's.
+        """
+        if clock is None:
+            clock = listener.clock if listener is not None else Clock()
+        loop = asyncio.get_running_loop()
+        found = {}
+        done = loop.create_future()
+
+        targets = []
+        for host in hosts or ():
             try:
-                resp_sock.bind(("", cls.DISCOVER_RESP_PORT))
-            except Exception:
-                _LOGGER.error("Cannot bind to discovery port")
-                return []
+                addrs = await loop.getaddrinfo(
+                    host, cls.DISCOVER_REQ_PORT, family=socket.AF_INET
+                )
+            except socket.gaierror:
+                _LOGGER.warning("Cannot resolve %s", host)
+                continue
+            targets.append(addrs[0][4][0])
+        if hosts and not targets:
+            return []
+
+        def _on_response(ip, data, resp=None):
+            if ip in found or (targets and ip not in targets):
+                return
+            if resp is None:
+                resp = parse_response(data)
+            if resp is None or len(resp) == 0 or resp.find("control") is None:
+                _LOGGER.debug("Ignoring invalid ping response from %s", ip)
+                return
+            _LOGGER.debug("Ping response from %s", ip)
+            found[ip] = resp
+            if targets and len(found) == len(targets) and not done.done():
+                done.set_result(None)
+
+        if listener is not None:
+            remove_listener = listener.async_add_listener(
+                lambda ip, resp: _on_response(ip, None, resp)
+            )
 
-        resp_sock.settimeout(0.5)
+            def _send(ip):
+                listener.ping(ip, version)
 
-        req_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        req_sock.bind(("", 0))
-        req_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            def _close():
+                remove_listener()
 
-        req = cls.format_request(
-            "emotivaPing",
-            {},
-            {"protocol": "3.0"} if version == 3.0 else {},
-        )
+        else:
+            try:
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _DiscoveryProtocol(_on_response),
+                    local_addr=("0.0.0.0", cls.DISCOVER_RESP_PORT),
+                    allow_broadcast=True,
+                )
+            except OSError as e:
+                _LOGGER.error("Cannot bind to discovery port: %s", e.strerror)
+                return []
+
+            req = get_protocol(version).ping_request()
 
-        _LOGGER.debug("discover Broadcast Req: %s", req)
-        req_sock.sendto(req, ("<broadcast>", cls.DISCOVER_REQ_PORT))
+            def _send(ip):
+                transport.sendto(req, (ip, cls.DISCOVER_REQ_PORT))
 
-        devices = []
-        while True:
+            def _close():
+                transport.close()
+
+        try:
+            for ip in targets or broadcasts or ["255.255.255.255"]:
+                _LOGGER.debug("Sending discovery ping to %s", ip)
+                _send(ip)
             try:
-                _resp_data, (ip, port) = resp_sock.recvfrom(4096)
+                await clock.wait_for(done, timeout)
+            except TimeoutError:
+                pass
+        finally:
+            _close()
 
-                resp = cls._parse_response(_resp_data)
-                _LOGGER.debug("Parsed ping response %s", resp)
-                devices.append((ip, resp))
-            except socket.timeout:
-                break
-        if len(devices) > 0:
-            # return devices[0]
-            return devices
-        else:
-            return None
+        return list(found.items())
 
     @classmethod
     def _parse_response(cls, data):
-        # _LOGGER.debug("parse_response: %s", data)
-        try:
-            parser = etree.XMLParser(ns_clean=True, recover=True)
-            root = etree.XML(data, parser)
-        except etree.ParseError:
-            _LOGGER.error("Malformed XML")
-            _LOGGER.error(data)
-            root = ""
-        return root
+        return parse_response(data)
 
     @classmethod
     def format_request(cls, pkt_type, req={}, pkt_attrs={}):
@@ -716,28 +1341,69 @@ class Emotiva(object):
         pkt_attrs is a dictionary containing element attributes. E.g.
         {'protocol': "3.0"}
         """
-        output = cls.XML_HEADER
-        builder = etree.TreeBuilder()
-        builder.start(pkt_type, pkt_attrs)
-        for cmd, params in req:
-            builder.start(cmd, params)
-            builder.end(cmd)
-        builder.end(pkt_type)
-        pkt = builder.close()
-        return output + etree.tostring(pkt)
+        return build_request(pkt_type, req, pkt_attrs)
+
+    @property
+    def protocol(self):
+        return self._protocol
+
+    def diagnostics(self):
+        """Return a snapshot of the processor's state for diagnostics."""
+        return {
+            "model": self._model,
+            "profile": self._profile.name,
+            "local_address": (
+                self._notifiers.command.local_address if self._notifiers else None
+            ),
+            "protocol": self._protocol.version,
+            "control_port": self._ctrl_port,
+            "notify_port": self._notify_port,
+            "subscribed": sorted(self._subscribed),
+            "idle": self._idle,
+            "power_saving": dict(
+                self._power_stats, ping_interval=self.ping_watcher.interval
+            ),
+            "send_errors": self._send_errors,
+            "commands": self._command_stats,
+            "timing": self._timing,
+            "tasks": self._tasks.diagnostics(),
+            "volume_ramp": dict(self._ramp_stats, active=self.ramping),
+            "change_events": self._change_events.diagnostics(),
+            "sequence": dict(self._sequence_stats, last=self._sequence),
+            "state": self._current_state,
+            "history": self._history.diagnostics(),
+        }
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def unique_id(self):
+        return "emotiva_" + self._name.replace(" ", "_").replace("-", "_").replace(
+            ":", "_"
+        )
+
     @property
     def model(self):
         return self._model
 
+    @property
+    def profile(self):
+        return self._profile
+
     @property
     def address(self):
         return self._ip
 
+    @property
+    def control_port(self):
+        return self._ctrl_port
+
+    @property
+    def notify_port(self):
+        return self._notify_port
+
     @property
     def power(self):
         if self._current_state["power"] == "On":
@@ -752,8 +1418,7 @@ class Emotiva(object):
     @property
     def volume_level(self):
         if self._current_state["volume"] is not None:
-            _vol = float(self._current_state["volume"].replace(" ", ""))
-            return (_vol - self._volume_min) / self._volume_range
+            return self._volume_curve.to_level(self.volume)
         return None
 
     @property
@@ -772,29 +1437,122 @@ class Emotiva(object):
     async def _async_volume_step(self, incr):
         await self._async_send_emotivacontrol("volume", incr)
 
-    async def async_volume_set(self, vol):
+    async def async_volume_set(self, vol, force=False):
+        self.cancel_volume_ramp()
+        await self._async_volume_set(vol, force)
+
+    async def _async_volume_set(self, vol, force=False):
+        if not force and "volume" not in self._pending and self.volume is not None:
+            if self._volume_curve.quantise(float(vol)) == self._volume_curve.quantise(
+                self.volume
+            ):
+                self._suppressed("Volume", vol)
+                return
+        self._set_optimistic("volume", "%.1f" % float(vol))
         await self._async_send_emotivacontrol("set_volume", vol)
 
+    def set_volume_curve(self, curve):
+        self._volume_curve = curve
+
+    async def async_set_volume_level(self, level, force=False):
+        _vol = self._volume_curve.to_db(level)
+        await self.async_volume_set("%.1f" % _vol, force)
+
     async def async_volume_up(self):
+        self.cancel_volume_ramp()
         await self._async_volume_step(1)
 
     async def async_volume_down(self):
+        self.cancel_volume_ramp()
         await self._async_volume_step(-1)
 
+    async def async_volume_ramp(self, level, duration, curve=CURVE_LINEAR):
+        """Move the volume to level over duration seconds.
+
+        The ramp runs in the background until it completes or the volume is
+        changed by any other means.
+        """
+        self.cancel_volume_ramp()
+        target = self._volume_curve.to_db(level)
+        if self.volume is None:
+            # Nothing to ramp from
+            await self._async_volume_set("%.1f" % target)
+            return
+        schedule = ramp_schedule(self.volume, target, duration, curve)
+        if not schedule:
+            return
+        _LOGGER.debug(
+            "Ramping %s volume from %s to %s over %ss in %d steps",
+            self._name,
+            self.volume,
+            target,
+            duration,
+            len(schedule),
+        )
+        self._ramp_stats["started"] += 1
+        self._ramp_steps.clear()
+        self._add_ramp_step(VolumeCurve.quantise(self.volume))
+        self._ramp_task = self._clock.create_task(
+            self._async_run_ramp(schedule), name="emotiva %s ramp" % self._name
+        )
+
+    async def _async_run_ramp(self, schedule):
+        start = self._clock.monotonic()
+        try:
+            for offset, db in schedule:
+                delay = start + offset - self._clock.monotonic()
+                if delay > 0:
+                    await self._clock.sleep(delay)
+                self._add_ramp_step(db)
+                await self._async_volume_set("%.1f" % db)
+            self._ramp_stats["completed"] += 1
+        finally:
+            if self._ramp_task is asyncio.current_task():
+                self._ramp_task = None
+
+    def cancel_volume_ramp(self):
+        if self._ramp_task is None:
+            return
+        _LOGGER.debug("Cancelling %s volume ramp", self._name)
+        self._ramp_task.cancel()
+        self._ramp_task = None
+        self._ramp_stats["cancelled"] += 1
+
+    @property
+    def ramping(self):
+        return self._ramp_task is not None
+
     async def async_mute_toggle(self):
+        self.cancel_volume_ramp()
         await self._async_send_emotivacontrol("mute", "0")
 
-    async def async_set_mute(self, enable):
+    async def async_set_mute(self, enable, force=False):
+        self.cancel_volume_ramp()
+        if not force and self._current_state["volume"] is not None:
+            if self._unchanged("mute", enable):
+                self._suppressed("Mute", enable)
+                return
         mute_cmd = {True: "mute_on", False: "mute_off"}[enable]
+        self._set_optimistic("mute", enable)
         await self._async_send_emotivacontrol(mute_cmd, "0")
 
-    async def async_turn_off(self):
+    async def async_turn_off(self, force=False):
+        if not force and self._unchanged("power", "Off"):
+            self._suppressed("Power", "Off")
+            return
+        self._set_optimistic("power", "Off")
         await self._async_send_emotivacontrol("power_off", "0")
 
-    async def async_turn_on(self):
+    async def async_turn_on(self, force=False):
+        if not force and self._unchanged("power", "On"):
+            self._suppressed("Power", "On")
+            return
+        self._set_optimistic("power", "On")
         await self._async_send_emotivacontrol("power_on", "0")
 
     async def async_send_command(self, command, value):
+        if command in ("volume", "set_volume", "mute", "mute_on", "mute_off"):
+            self.cancel_volume_ramp()
         await self._async_send_emotivacontrol(command, value)
 
     @property
@@ -808,26 +1566,37 @@ class Emotiva(object):
 
     @property
     def sources(self):
-        return tuple(self._sources.values())
+        """Return the labels of the sources the processor shows."""
+        if self._sources is None:
+            self._build_sources()
+        return self._sources
 
     @property
     def source(self):
         return self._current_state["source"]
 
-    async def async_set_source(self, val):
-        _source_key = list(self._sources.keys())[
-            list(self._sources.values()).index(val)
-        ]
-
-        if val not in self._sources.values():
+    async def async_set_source(self, val, force=False):
+        if self._source_keys is None:
+            self._build_sources()
+        _source_key = self._source_keys.get(val)
+        if _source_key is None:
             raise InvalidSourceError('Source "%s" is not a valid input' % val)
 
+        if not force and self._unchanged("source", val):
+            self._suppressed("Source", val)
+            return
+
+        self._set_optimistic("source", val)
         await self._async_send_emotivacontrol(_source_key, "0")
 
     @property
     def modes(self):
         # we return only the modes that are active
-        return tuple(dict(filter(lambda elem: elem[1][2], self._modes.items())).keys())
+        return tuple(
+            mode
+            for mode, v in self._profile.modes.items()
+            if v.property in self._visible_modes
+        )
 
     @property
     def mode(self):
@@ -837,24 +1606,17 @@ class Emotiva(object):
             _LOGGER.error("Unknown sound mode %s", self._current_state["mode"])
             return ""
 
-    async def async_set_mode(self, val):
-        if val not in self._modes:
+    async def async_set_mode(self, val, force=False):
+        mode = self._profile.modes.get(val)
+        if mode is None:
             raise InvalidModeError('Mode "%s" does not exist' % val)
-        elif self._modes[val][0] is None:
-            raise InvalidModeError(
-                'Mode "%s" has bad command value (%s)' % (val, self._modes[val][0])
-            )
-        await self._async_send_emotivacontrol(self._modes[val][0], "0")
-
-        if self._current_state["mode_music"] in val:
-            _LOGGER.debug(
-                "Sound Mode Music.  mode_music %s", self._current_state["mode_music"]
-            )
-            await asyncio.sleep(0.25)
-            await self._async_send_emotivacontrol("music", "0")
-        elif self._current_state["mode_movie"] in val or "cinema" in val:
-            _LOGGER.debug(
-                "Sound Mode Movie.  mode_movie %s", self._current_state["mode_movie"]
-            )
-            await asyncio.sleep(0.25)
-            await self._async_send_emotivacontrol("movie", "0")
+        elif not mode.commands:
+            raise InvalidModeError('Mode "%s" has no commands' % val)
+        if not force and self._unchanged("mode", val):
+            self._suppressed("Mode", val)
+            return
+        self._set_optimistic("mode", val)
+        await self._async_send_emotivacontrol(mode.commands[0], "0")
+        for command in mode.commands[1:]:
+            await self._clock.sleep(0.25)
+            await self._async_send_emotivacontrol(command, "0")
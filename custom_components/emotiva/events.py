@@ -0,0 +1,93 @@
+"""Bus events for changes to a processor's input and signal formats."""
+
+import logging
+
+from .clock import Clock
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT_FORMAT_CHANGED = "emotiva_format_changed"
+EVENT_INPUT_CHANGED = "emotiva_input_changed"
+
+EVENT_TYPES = {
+    "audio_bitstream": EVENT_FORMAT_CHANGED,
+    "video_format": EVENT_FORMAT_CHANGED,
+    "video_space": EVENT_FORMAT_CHANGED,
+    "audio_input": EVENT_INPUT_CHANGED,
+    "source": EVENT_INPUT_CHANGED,
+}
+
+# A new value must be held this long before it is reported
+SETTLE_TIME = 1.0
+# and a property is reported no more often than this
+MIN_INTERVAL = 5.0
+
+
+class ChangeEvents(object):
+    """Report properties which settle on a new value through fire().
+
+    A value which changes again, or changes back, within the settle time
+    is not reported, so the processor briefly losing sync while it switches
+    formats doesn't trigger automations.
+    """
+
+    def __init__(self, fire, settle=SETTLE_TIME, min_interval=MIN_INTERVAL, clock=None):
+        self._fire = fire
+        self._clock = clock or Clock()
+        self._settle = settle
+        self._min_interval = min_interval
+        # value last reported, or first seen, for each property
+        self._reported = {}
+        self._latest = {}
+        self._reported_at = {}
+        self._timers = {}
+        self.fired = 0
+        self.suppressed = 0
+
+    def update(self, key, value):
+        """Record a value for a property from a notification."""
+        if not value:
+            return
+        if key not in self._reported:
+            self._reported[key] = value
+            return
+        if value == self._latest.get(key):
+            return
+        self._latest[key] = value
+
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+            self.suppressed += 1
+        if value == self._reported[key]:
+            self._latest.pop(key)
+            return
+
+        at = self._clock.monotonic() + self._settle
+        if key in self._reported_at:
+            at = max(at, self._reported_at[key] + self._min_interval)
+        self._timers[key] = self._clock.call_at(at, self._settled, key)
+
+    def _settled(self, key):
+        del self._timers[key]
+        old = self._reported[key]
+        new = self._reported[key] = self._latest.pop(key)
+        self._reported_at[key] = self._clock.monotonic()
+        self.fired += 1
+        _LOGGER.debug("%s changed from %s to %s", key, old, new)
+        self._fire(
+            EVENT_TYPES[key], {"property": key, "old_value": old, "new_value": new}
+        )
+
+    def cancel(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._latest.clear()
+
+    def diagnostics(self):
+        return {
+            "fired": self.fired,
+            "suppressed": self.suppressed,
+            "settling": sorted(self._timers),
+        }
@@ -0,0 +1,97 @@
+"""Fixed size, in memory timeline of a processor's recent activity."""
+
+from array import array
+
+KIND_PROPERTY = 0
+KIND_COMMAND = 1
+KIND_LATENCY = 2
+
+KINDS = ("property", "command", "latency")
+
+DEFAULT_CAPACITY = 1024
+
+
+class History(object):
+    """Ring buffer of property changes, commands sent and command latencies.
+
+    Timestamps, kinds and names are held in typed arrays sized once, with
+    names interned, so recording is a few index assignments and the memory
+    used doesn't grow.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._capacity = capacity
+        self._time = array("d", bytes(8 * capacity))
+        self._kind = array("B", bytes(capacity))
+        self._name = array("H", bytes(2 * capacity))
+        self._value = [None] * capacity
+        self._names = []
+        self._name_ids = {}
+        # Total records made, so the next slot is _count % _capacity
+        self._count = 0
+
+    def _name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def record(self, ts, kind, name, value):
+        i = self._count % self._capacity
+        self._time[i] = ts
+        self._kind[i] = kind
+        self._name[i] = self._name_id(name)
+        self._value[i] = value
+        self._count += 1
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def _indexes(self):
+        start = max(0, self._count - self._capacity)
+        return (n % self._capacity for n in range(start, self._count))
+
+    def query(self, kind=None, name=None, since=None, limit=None):
+        """Return the matching records, oldest first, as dicts."""
+        kind = KINDS.index(kind) if kind is not None else None
+        name_id = self._name_ids.get(name) if name is not None else None
+        if name is not None and name_id is None:
+            return []
+        records = [
+            {
+                "time": round(self._time[i], 3),
+                "kind": KINDS[self._kind[i]],
+                "name": self._names[self._name[i]],
+                "value": self._value[i],
+            }
+            for i in self._indexes()
+            if (kind is None or self._kind[i] == kind)
+            and (name_id is None or self._name[i] == name_id)
+            and (since is None or self._time[i] >= since)
+        ]
+        if limit is not None:
+            records = records[-limit:] if limit else []
+        return records
+
+    def latency_summary(self):
+        """Return the count, median and maximum of the latencies held."""
+        latencies = sorted(
+            self._value[i] for i in self._indexes() if self._kind[i] == KIND_LATENCY
+        )
+        if not latencies:
+            return {"count": 0}
+        return {
+            "count": len(latencies),
+            "median": latencies[len(latencies) // 2],
+            "max": latencies[-1],
+        }
+
+    def diagnostics(self):
+        return {
+            "capacity": self._capacity,
+            "recorded": self._count,
+            "overwritten": max(0, self._count - self._capacity),
+            "latency": self.latency_summary(),
+            "records": self.query(),
+        }
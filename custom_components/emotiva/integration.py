@@ -0,0 +1,569 @@
+"""Home Assistant setup of the emotiva component."""
+
+import asyncio
+import importlib
+import sys
+import time
+
+_import_started = time.monotonic()
+
+import logging  # noqa: E402
+
+import voluptuous as vol  # noqa: E402
+
+from homeassistant import config_entries, core
+from homeassistant.components.network import async_get_source_ip
+from homeassistant.const import (
+    ATTR_ENTITY_ID,
+    CONF_HOST,
+    CONF_MODEL,
+    CONF_NAME,
+    EVENT_HOMEASSISTANT_STOP,
+    Platform,
+)
+from homeassistant.core import ServiceCall, SupportsResponse, callback
+from homeassistant.exceptions import ConfigEntryNotReady, ServiceValidationError
+from homeassistant.helpers import config_validation as cv, entity_registry as er
+from homeassistant.helpers.storage import Store
+from homeassistant.util import slugify
+
+from .capture import EmotivaCapture
+from .const import (
+    CAPTURE_FILE,
+    CONF_CAPTURE,
+    CONF_CTRL_PORT,
+    CONF_DISCOVER,
+    CONF_NOTIFICATIONS,
+    CONF_NOTIFY_PORT,
+    CONF_PASSIVE_DISCOVERY,
+    CONF_PING_INTERVAL,
+    CONF_PROTO_VER,
+    CONF_TEARDOWN_TIMEOUT,
+    CONF_TYPE,
+    CONF_VOLUME_CURVE,
+    CONF_VOLUME_MAX,
+    CONF_VOLUME_MIN,
+    DEFAULT_CTRL_PORT,
+    DEFAULT_NOTIFY_PORT,
+    DEFAULT_TEARDOWN_TIMEOUT,
+    DOMAIN,
+    PASSIVE_PROBE_INTERVAL,
+    PROBE_TIMEOUT,
+    SERVICE_GROUP_COMMAND,
+    STORAGE_VERSION,
+)
+from .emotiva import (
+    Emotiva,
+    EmotivaNotifier,
+    EmotivaNotifiers,
+    EmotivaTransponderListener,
+)
+from .interfaces import async_get_interfaces, broadcast_addresses, local_address
+from .protocol import parse_transponder
+from .volume import CURVE_LINEAR, VolumeCurve
+
+# Time taken to import the component on the bootstrap path
+IMPORT_DURATION = time.monotonic() - _import_started
+
+_LOGGER = logging.getLogger(__name__)
+
+PLATFORMS = [Platform.MEDIA_PLAYER, Platform.REMOTE, Platform.SELECT, Platform.SENSOR]
+
+# The core imports these on first use, which would be on the event loop
+_DEFERRED_IMPORTS = ("lxml.etree", "asyncping3")
+
+
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+GROUP_COMMAND_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+        vol.Required("command"): cv.string,
+        vol.Optional("value", default="0"): cv.string,
+    }
+)
+
+
+async def async_setup(hass: core.HomeAssistant, config) -> bool:
+    """Register the integration's services."""
+
+    async def async_group_command(call: ServiceCall):
+        devices = _resolve_devices(hass, call.data.get(ATTR_ENTITY_ID))
+        return await _async_group_command(
+            devices, call.data["command"], call.data["value"]
+        )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GROUP_COMMAND,
+        async_group_command,
+        schema=GROUP_COMMAND_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    return True
+
+
+def _resolve_devices(hass: core.HomeAssistant, entity_ids):
+    """Return the processors behind entity_ids, or every processor."""
+    if entity_ids is None:
+        return [device for _entry, device in _loaded_devices(hass)]
+
+    registry = er.async_get(hass)
+    devices = []
+    for entity_id in entity_ids:
+        reg = registry.async_get(entity_id)
+        device = None
+        if reg is not None and reg.platform == DOMAIN:
+            entry_data = hass.data.get(DOMAIN, {}).get(reg.config_entry_id)
+            for _device in entry_data["emotiva"] if entry_data else ():
+                if _device.unique_id == reg.unique_id:
+                    device = _device
+        if device is None:
+            raise ServiceValidationError(
+                "%s is not a loaded Emotiva processor" % entity_id
+            )
+        if device not in devices:
+            devices.append(device)
+    return devices
+
+
+async def _async_group_command(devices, command, value):
+    """Send command to every processor at once and report how each went."""
+    started = time.monotonic()
+    results = await asyncio.gather(
+        *(device.async_command(command, value) for device in devices),
+        return_exceptions=True,
+    )
+    report = {}
+    for device, result in zip(devices, results):
+        if isinstance(result, Exception):
+            _LOGGER.warning("Error sending %s to %s: %s", command, device.name, result)
+            result = {"sent": False, "confirmed": False, "error": str(result)}
+        report[device.name] = result
+    return {
+        "processors": report,
+        "elapsed": round(time.monotonic() - started, 4),
+    }
+
+
+async def async_setup_entry(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry
+) -> bool:
+    """Set up platform from a ConfigEntry."""
+    hass.data.setdefault(DOMAIN, {})
+    await _async_preload_imports(hass)
+    hass_data = dict(entry.data)
+    _setup_started = time.monotonic()
+    timing = {"import": round(IMPORT_DURATION, 3)}
+
+    emotiva = []
+    _control_port = None
+    _notify_port = None
+    interfaces = await async_get_interfaces(hass)
+
+    if CONF_HOST in hass_data:
+        # A single processor, either probed by the config flow or entered manually
+        _LOGGER.debug(
+            "Adding %s Name: %s Model: %s from %s Config",
+            hass_data[CONF_HOST],
+            hass_data[CONF_NAME],
+            hass_data[CONF_MODEL],
+            hass_data.get(CONF_TYPE, "Manual"),
+        )
+
+        _control_port = hass_data.get(CONF_CTRL_PORT, DEFAULT_CTRL_PORT)
+        _notify_port = hass_data.get(CONF_NOTIFY_PORT, DEFAULT_NOTIFY_PORT)
+
+        emotiva.append(
+            Emotiva(
+                hass_data[CONF_HOST],
+                transp_xml="",
+                _ctrl_port=_control_port,
+                _notify_port=_notify_port,
+                _proto_ver=hass_data[CONF_PROTO_VER],
+                _name=hass_data[CONF_NAME],
+                _model=hass_data[CONF_MODEL],
+            )
+        )
+
+    elif hass_data.get(CONF_TYPE, None) == "Discover" or hass_data.get(
+        CONF_DISCOVER, None
+    ):
+        # Entries created before processors were probed by the config flow
+        # discover every processor at each setup
+        receivers = await Emotiva.async_discover(
+            listener=hass.data[DOMAIN].get("transponder_listener"),
+            broadcasts=broadcast_addresses(interfaces),
+        )
+        timing["discovery"] = round(time.monotonic() - _setup_started, 3)
+
+        for _ip, _xml in receivers:
+            # Server was discovered
+            if not _control_port or not _notify_port:
+                info = parse_transponder(_xml)
+                _control_port = info.get("control_port")
+                _notify_port = info.get("notify_port")
+
+            emotiva.append(Emotiva(_ip, _xml))
+            _LOGGER.debug("Adding %s from Discovery", _ip)
+
+    if len(emotiva) == 0:
+        _LOGGER.critical("No processor discovered, and no manual processor info")
+        return False
+
+    if not _control_port or not _notify_port:
+        _LOGGER.critical("Cannot discover control and/or notify ports")
+        return False
+
+    for device in emotiva:
+        _attach_device(hass, entry, device)
+
+    # Get additional notify
+
+    if CONF_NOTIFICATIONS in entry.options:
+        _update_extra_notifications(emotiva, entry.options[CONF_NOTIFICATIONS])
+
+    _update_volume_curve(emotiva, entry.options)
+
+    # Bring entities up with the last known state until live data arrives
+    for device in emotiva:
+        await device.async_restore_state()
+
+    hass_data["emotiva"] = emotiva
+    hass_data["timing"] = timing
+
+    # Registers update listener to update config entry when options are updated.
+    unsub_options_update_listener = entry.add_update_listener(options_update_listener)
+    # Store a reference to the unsubscribe function to cleanup if an entry is unloaded.
+    hass_data["unsub_options_update_listener"] = unsub_options_update_listener
+
+    hass.data[DOMAIN][entry.entry_id] = hass_data
+
+    _LOGGER.debug(
+        "Adding new Config Entry.  %d total configurations",
+        len(hass.config_entries.async_entries(DOMAIN)),
+    )
+
+    # Each processor is reached through the notifiers on the local address
+    # facing it, shared with any other processors on that network
+    all_notifiers = hass.data[DOMAIN].setdefault("notifiers", {})
+    source_ip = await async_get_source_ip(hass)
+    started = []
+    for device in emotiva:
+        _local_ip = local_address(interfaces, device.address) or source_ip
+        if _local_ip not in all_notifiers:
+            try:
+                await _async_start_notifiers(
+                    hass, _local_ip, _control_port, _notify_port
+                )
+            except OSError as e:
+                for _ip in started:
+                    await _async_stop_notifiers(hass, all_notifiers.pop(_ip))
+                hass.data[DOMAIN].pop(entry.entry_id)
+                unsub_options_update_listener()
+                raise ConfigEntryNotReady(
+                    f"Cannot bind to local notification ports on {_local_ip}: "
+                    f"{e.strerror}"
+                ) from e
+            started.append(_local_ip)
+        _LOGGER.debug("Reaching %s through %s", device.address, _local_ip)
+        device.set_notifiers(all_notifiers[_local_ip])
+
+    await _async_update_capture(hass)
+    await _async_update_transponder_listener(hass)
+
+    async def _async_stop(event):
+        await _async_shutdown_processors(hass, entry, emotiva)
+
+    entry.async_on_unload(
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_stop)
+    )
+
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+
+    timing["setup"] = round(time.monotonic() - _setup_started, 3)
+
+    return True
+
+
+async def _async_preload_imports(hass: core.HomeAssistant):
+    """Import the core's deferred dependencies in the executor."""
+    for name in _DEFERRED_IMPORTS:
+        if name not in sys.modules:
+            await hass.async_add_executor_job(importlib.import_module, name)
+
+
+async def _async_update_capture(hass: core.HomeAssistant):
+    """Start or stop the packet capture to match the entry options."""
+    enabled = any(
+        _entry.options.get(CONF_CAPTURE, False)
+        for _entry in hass.config_entries.async_entries(DOMAIN)
+        if not _entry.disabled_by
+    )
+    capture = hass.data[DOMAIN].get("capture")
+
+    if enabled and capture is None:
+        capture = EmotivaCapture(hass.config.path(DOMAIN, CAPTURE_FILE))
+        _LOGGER.info("Capturing processor traffic to %s", capture.path)
+        capture.start()
+        hass.data[DOMAIN]["capture"] = capture
+    elif not enabled and capture is not None:
+        _LOGGER.info("Stopping capture of processor traffic")
+        hass.data[DOMAIN].pop("capture")
+        await hass.async_add_executor_job(capture.close)
+
+    capture = hass.data[DOMAIN].get("capture")
+    for notifiers in hass.data[DOMAIN].get("notifiers", {}).values():
+        notifiers.subscription.capture = capture
+        notifiers.command.capture = capture
+
+
+async def _async_start_notifiers(
+    hass: core.HomeAssistant, local_ip, control_port, notify_port
+):
+    """Bind notifiers on a local address and share them with other processors."""
+    notifiers = EmotivaNotifiers()
+    notifiers.subscription = EmotivaNotifier()
+    notifiers.command = EmotivaNotifier()
+    try:
+        await notifiers.subscription._async_start(local_ip, notify_port)
+        await notifiers.command._async_start(local_ip, control_port)
+    except OSError:
+        await notifiers.subscription._async_stop()
+        raise
+    capture = hass.data[DOMAIN].get("capture")
+    notifiers.subscription.capture = notifiers.command.capture = capture
+    hass.data[DOMAIN].setdefault("notifiers", {})[local_ip] = notifiers
+    return notifiers
+
+
+async def _async_stop_notifiers(hass: core.HomeAssistant, notifiers):
+    await notifiers.subscription._async_stop()
+    await notifiers.command._async_stop()
+
+
+async def _async_shutdown_processors(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry, emotiva
+):
+    """Shut down the entry's processors concurrently, within the deadline."""
+    started = time.monotonic()
+    deadline = entry.options.get(CONF_TEARDOWN_TIMEOUT, DEFAULT_TEARDOWN_TIMEOUT)
+    timed_out = False
+
+    try:
+        async with asyncio.timeout(deadline):
+            results = await asyncio.gather(
+                *(device.async_shutdown() for device in emotiva),
+                return_exceptions=True,
+            )
+    except TimeoutError:
+        timed_out = True
+        _LOGGER.warning("Shutting down processors took more than %ss", deadline)
+    else:
+        for device, result in zip(emotiva, results):
+            if isinstance(result, Exception):
+                _LOGGER.warning("Error shutting down %s: %s", device.name, result)
+
+    duration = round(time.monotonic() - started, 3)
+    _LOGGER.debug("Shut down %d processors in %.3fs", len(emotiva), duration)
+    hass.data[DOMAIN].setdefault("teardown", {})[entry.entry_id] = {
+        "duration": duration,
+        "timed_out": timed_out,
+    }
+
+
+def _loaded_devices(hass: core.HomeAssistant):
+    """Yield (entry, processor) for every processor set up."""
+    for _entry in hass.config_entries.async_entries(DOMAIN):
+        entry_data = hass.data[DOMAIN].get(_entry.entry_id)
+        if entry_data is None:
+            continue
+        for device in entry_data["emotiva"]:
+            yield _entry, device
+
+
+async def _async_update_transponder_listener(hass: core.HomeAssistant):
+    """Start or stop the passive transponder listener to match the entry options."""
+    enabled = any(
+        _entry.options.get(CONF_PASSIVE_DISCOVERY, False)
+        for _entry in hass.config_entries.async_entries(DOMAIN)
+        if not _entry.disabled_by
+    )
+    listener = hass.data[DOMAIN].get("transponder_listener")
+
+    if enabled and listener is None:
+        listener = EmotivaTransponderListener()
+        try:
+            await listener._async_start()
+        except OSError as e:
+            _LOGGER.error("Cannot start transponder listener: %s", e.strerror)
+            return
+        listener.async_add_listener(
+            lambda ip, transp_xml: _async_transponder_seen(hass, ip, transp_xml)
+        )
+        hass.data[DOMAIN]["transponder_listener"] = listener
+        hass.data[DOMAIN]["transponder_probe_task"] = hass.async_create_background_task(
+            _async_probe_processors(hass, listener),
+            name="emotiva transponder probe task",
+        )
+    elif not enabled and listener is not None:
+        await _async_stop_transponder_listener(hass)
+
+
+async def _async_stop_transponder_listener(hass: core.HomeAssistant):
+    _LOGGER.debug("Stopping transponder listener")
+    if (task := hass.data[DOMAIN].pop("transponder_probe_task", None)) is not None:
+        task.cancel()
+    if (listener := hass.data[DOMAIN].pop("transponder_listener", None)) is not None:
+        await listener._async_stop()
+
+
+@callback
+def _async_transponder_seen(hass: core.HomeAssistant, ip, transp_xml):
+    """Follow a processor which answers from a new address."""
+    info = parse_transponder(transp_xml)
+    for _entry, device in list(_loaded_devices(hass)):
+        if device.name != info.get("name") or device.address == ip:
+            continue
+        if _entry.data.get(CONF_HOST) == device.address:
+            hass.config_entries.async_update_entry(
+                _entry, data={**_entry.data, CONF_HOST: ip}
+            )
+        hass.async_create_task(_async_move_processor(hass, device, ip))
+
+
+async def _async_move_processor(hass: core.HomeAssistant, device: Emotiva, ip):
+    """Move a processor to its new address, through the notifiers facing it."""
+    interfaces = await async_get_interfaces(hass)
+    local_ip = local_address(interfaces, ip) or await async_get_source_ip(hass)
+    notifiers = hass.data[DOMAIN]["notifiers"].get(local_ip)
+    if notifiers is None:
+        try:
+            notifiers = await _async_start_notifiers(
+                hass, local_ip, device.control_port, device.notify_port
+            )
+        except OSError as e:
+            _LOGGER.error(
+                "Cannot bind to local notification ports on %s: %s.  Reaching "
+                "%s through its previous local address",
+                local_ip,
+                e.strerror,
+                device.name,
+            )
+    await device.async_set_address(ip, notifiers)
+
+
+async def _async_probe_processors(hass: core.HomeAssistant, listener):
+    """Occasionally ping known processors, and search if one doesn't answer."""
+    clock = listener.clock
+    while True:
+        await clock.sleep(PASSIVE_PROBE_INTERVAL)
+        devices = [device for _entry, device in _loaded_devices(hass)]
+        started = clock.monotonic()
+        for device in devices:
+            listener.ping(device.address, device.protocol.version)
+        await clock.sleep(PROBE_TIMEOUT)
+        if any(
+            listener.seen.get(device.address, (None, 0))[1] < started
+            for device in devices
+        ):
+            _LOGGER.debug("Processor didn't answer probe.  Searching for it")
+            for address in broadcast_addresses(await async_get_interfaces(hass)):
+                listener.ping(address)
+
+
+def _attach_device(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry, device: Emotiva
+):
+    """Connect a processor session to Home Assistant's storage, bus and reloads."""
+    device.set_store(
+        Store(hass, STORAGE_VERSION, f"{DOMAIN}.{slugify(device.name)}_state")
+    )
+    device.set_event_cb(hass.bus.async_fire)
+    device.ping_watcher.set_interval(entry.options.get(CONF_PING_INTERVAL, 60))
+    device.ping_watcher.set_reconnect_cb(
+        lambda: hass.config_entries.async_schedule_reload(entry.entry_id)
+    )
+
+
+def _update_extra_notifications(emotiva, notifications):
+    if notifications is not None:
+        _LOGGER.debug("Adding %s", notifications)
+        _notify_set = set(notifications.replace(" ", "").split(",")) - {""}
+    else:
+        _notify_set = set()
+
+    for device in emotiva:
+        device.set_events(device.NOTIFY_EVENTS.union(_notify_set))
+
+
+def _update_volume_curve(emotiva, options):
+    for device in emotiva:
+        profile = device.profile
+        try:
+            curve = VolumeCurve(
+                options.get(CONF_VOLUME_MIN, profile.volume_min),
+                options.get(CONF_VOLUME_MAX, profile.volume_max),
+                options.get(CONF_VOLUME_CURVE, CURVE_LINEAR),
+            )
+        except ValueError as e:
+            _LOGGER.error("Invalid volume limits, using defaults: %s", e)
+            curve = VolumeCurve(profile.volume_min, profile.volume_max)
+        device.set_volume_curve(curve)
+
+
+async def options_update_listener(
+    hass: core.HomeAssistant, config_entry: config_entries.ConfigEntry
+):
+    """Handle options update."""
+    emotiva = hass.data[DOMAIN][config_entry.entry_id]["emotiva"]
+    notifications = config_entry.options.get(CONF_NOTIFICATIONS, None)
+
+    # Only subscribe to, or unsubscribe from, the notifications which changed
+    _update_extra_notifications(emotiva, notifications)
+    for device in emotiva:
+        await device.async_set_events(device._events)
+
+    _update_volume_curve(emotiva, config_entry.options)
+
+    ping_interval = int(config_entry.options.get(CONF_PING_INTERVAL, 60))
+    for device in emotiva:
+        device.ping_watcher.set_interval(ping_interval)
+        if ping_interval > 0:
+            device.start_ping_watcher()
+
+    await _async_update_capture(hass)
+    await _async_update_transponder_listener(hass)
+
+
+async def async_unload_entry(
+    hass: core.HomeAssistant, entry: config_entries.ConfigEntry
+) -> bool:
+    """Unload a config entry."""
+    if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
+        # Remove config entry from domain.
+        entry_data = hass.data[DOMAIN].pop(entry.entry_id)
+        # Remove options_update_listener.
+        entry_data["unsub_options_update_listener"]()
+
+        await _async_shutdown_processors(hass, entry, entry_data["emotiva"])
+
+        _LOGGER.debug(
+            "Unloading Entry.  %d configurations remaining",
+            len(hass.config_entries.async_loaded_entries(DOMAIN)) - 1,
+        )
+
+        other_loaded_entries = [
+            _entry
+            for _entry in hass.config_entries.async_loaded_entries(DOMAIN)
+            if _entry.entry_id != entry.entry_id
+        ]
+        if not other_loaded_entries:
+            _LOGGER.debug("Unloading Listeners")
+            for _notifiers in hass.data[DOMAIN].pop("notifiers", {}).values():
+                await _async_stop_notifiers(hass, _notifiers)
+            if (capture := hass.data[DOMAIN].pop("capture", None)) is not None:
+                await hass.async_add_executor_job(capture.close)
+            await _async_stop_transponder_listener(hass)
+
+    return unload_ok
@@ -0,0 +1,49 @@
+"""Local network interfaces used to reach processors."""
+
+from __future__ import annotations
+
+import ipaddress
+
+from homeassistant import core
+from homeassistant.components import network
+
+LIMITED_BROADCAST = "255.255.255.255"
+
+
+async def async_get_interfaces(
+    hass: core.HomeAssistant,
+) -> list[ipaddress.IPv4Interface]:
+    """Return the IPv4 addresses, with their networks, of the enabled adapters."""
+    interfaces = []
+    for adapter in await network.async_get_adapters(hass):
+        if not adapter["enabled"]:
+            continue
+        for ip_info in adapter["ipv4"]:
+            interface = ipaddress.IPv4Interface(
+                "%s/%s" % (ip_info["address"], ip_info["network_prefix"])
+            )
+            if not interface.ip.is_loopback:
+                interfaces.append(interface)
+    return interfaces
+
+
+def broadcast_addresses(interfaces) -> list[str]:
+    """Return the broadcast address of each interface's network."""
+    addresses = {LIMITED_BROADCAST}
+    for interface in interfaces:
+        # Point to point networks have no broadcast address
+        if interface.network.prefixlen < 31:
+            addresses.add(str(interface.network.broadcast_address))
+    return sorted(addresses)
+
+
+def local_address(interfaces, host) -> str | None:
+    """Return the local address on the same network as host, if any."""
+    try:
+        address = ipaddress.IPv4Address(host)
+    except ValueError:
+        return None
+    for interface in interfaces:
+        if address in interface.network:
+            return str(interface.ip)
+    return None
@@ -16,7 +16,8 @@ from homeassistant.components.media_player import (
 from homeassistant import config_entries, core
 
 from homeassistant.const import CONF_HOST, CONF_NAME
-from homeassistant.core import callback
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers import (
     config_validation as cv,
     entity_platform,
@@ -29,8 +30,13 @@ from .const import (
     CONF_NOTIFY_PORT,
     CONF_CTRL_PORT,
     CONF_PROTO_VER,
+    SERVICE_GET_HISTORY,
+    SERVICE_REPLAY_CAPTURE,
     SERVICE_SEND_COMMAND,
+    SERVICE_VOLUME_RAMP,
 )
+from .history import KINDS
+from .volume import CURVE_LINEAR, CURVES
 
 
 import asyncio
@@ -70,9 +76,7 @@ async def async_setup_entry(
     emotiva_list = config["emotiva"]
 
     for emotiva in emotiva_list:
-        async_add_entities(
-            [EmotivaDevice(emotiva, hass, hass.data[DOMAIN]["notifiers"])]
-        )
+        async_add_entities([EmotivaDevice(emotiva, hass)])
 
     # Register entity services
     platform = entity_platform.async_get_current_platform()
@@ -84,18 +88,53 @@ async def async_setup_entry(
         },
         EmotivaDevice.send_command.__name__,
     )
+    platform.async_register_entity_service(
+        SERVICE_REPLAY_CAPTURE,
+        {
+            vol.Required("path"): cv.string,
+            vol.Optional("speed", default=1.0): vol.All(
+                vol.Coerce(float), vol.Range(min=0)
+            ),
+            vol.Optional("address"): cv.string,
+        },
+        EmotivaDevice.replay_capture.__name__,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    platform.async_register_entity_service(
+        SERVICE_VOLUME_RAMP,
+        {
+            vol.Required("volume_level"): vol.All(
+                vol.Coerce(float), vol.Range(min=0, max=1)
+            ),
+            vol.Required("duration"): vol.All(
+                vol.Coerce(float), vol.Range(min=0, max=3600)
+            ),
+            vol.Optional("curve", default=CURVE_LINEAR): vol.In(CURVES),
+        },
+        EmotivaDevice.volume_ramp.__name__,
+    )
+    platform.async_register_entity_service(
+        SERVICE_GET_HISTORY,
+        {
+            vol.Optional("kind"): vol.In(KINDS),
+            vol.Optional("name"): cv.string,
+            vol.Optional("limit", default=100): vol.All(
+                vol.Coerce(int), vol.Range(min=1)
+            ),
+        },
+        EmotivaDevice.get_history.__name__,
+        supports_response=SupportsResponse.ONLY,
+    )
 
 
 class EmotivaDevice(MediaPlayerEntity):
     # Representation of a Emotiva Processor
 
-    def __init__(self, device, hass, notifiers):
+    def __init__(self, device, hass):
         self._device = device
         self._hass = hass
         self._entity_id = "media_player.emotivaprocessor"
-        self._unique_id = "emotiva_" + self._device.name.replace(" ", "_").replace(
-            "-", "_"
-        ).replace(":", "_")
+        self._unique_id = self._device.unique_id
         self._device_class = "receiver"
         # self._notifier_task = None
         self._record_atrributes = {
@@ -107,25 +146,22 @@ class EmotivaDevice(MediaPlayerEntity):
             "video_input",
             "audio_bitstream",
         }
-        self._device.set_notifiers(notifiers)
 
     async def async_added_to_hass(self):
         """Subscribe to device events."""
         self._device.set_update_cb(self.async_update_callback)
 
         await self._device.register_with_notifier()
-        await self._device.udp_connect()
         await self._device.async_subscribe_events()
 
-        # Wait for initial subscription info to populate and push mode to update HA
-        await asyncio.sleep(1.0)
-        if self._device.mode:
-            await self._device.async_set_mode(self._device.mode)
-        else:
-            await self._device.async_set_mode("Stereo")
-        self._ping_task = self._hass.async_create_background_task(
-            self._device.run_ping_watcher(), name="emotiva ping watcher task"
-        )
+        # Mode visibility is only reported when a mode is set, so if nothing was
+        # restored from a previous run, wait for the subscription info and push
+        # the current mode to populate it
+        if not self._device.modes:
+            await asyncio.sleep(1.0)
+            if self._device.mode:
+                await self._device.async_set_mode(self._device.mode, force=True)
+        self._device.start_ping_watcher()
 
     @callback
     def async_update_callback(self, reason=False):
@@ -134,20 +170,9 @@ class EmotivaDevice(MediaPlayerEntity):
         self.async_schedule_update_ha_state()
 
     async def async_will_remove_from_hass(self) -> None:
-        await self._device.async_unsubscribe_events()
-
+        # The processor's session is shut down when the entry is unloaded
         self._device.set_update_cb(None)
 
-        await self._device.udp_disconnect()
-
-        await self._device.unregister_from_notifier()
-
-        try:
-            await self._device.stop_ping_watcher()
-            self._ping_task.cancel()
-        except Exception:
-            pass
-
     @property
     def should_poll(self):
         return False
@@ -245,6 +270,9 @@ class EmotivaDevice(MediaPlayerEntity):
         if self._device.mute:
             _attributes["volume"] = "0"
 
+        if self._device.pending:
+            _attributes["pending"] = list(self._device.pending)
+
         return _attributes
 
     _unrecorded_attributes = frozenset(
@@ -260,6 +288,7 @@ class EmotivaDevice(MediaPlayerEntity):
             "input_7",
             "input_8",
             "icon",
+            "pending",
         }
     )
 
@@ -269,17 +298,10 @@ class EmotivaDevice(MediaPlayerEntity):
             # device is muted
             return 0.0
         else:
-            return float(
-                "%.2f"
-                % (
-                    (self._device.volume - self._device._volume_min)
-                    / self._device._volume_range
-                )
-            )
+            return self._device.volume_level
 
     async def async_set_volume_level(self, volume: float) -> None:
-        _vol = (volume * self._device._volume_range) + self._device._volume_min
-        await self._device.async_volume_set(str(_vol))
+        await self._device.async_set_volume_level(volume)
 
     async def async_turn_off(self) -> None:
         await self._device.async_turn_off()
@@ -310,3 +332,29 @@ class EmotivaDevice(MediaPlayerEntity):
 
     async def send_command(self, Command, Value):
         await self._device.async_send_command(Command, Value)
+
+    async def volume_ramp(self, volume_level, duration, curve):
+        await self._device.async_volume_ramp(volume_level, duration, curve)
+
+    async def get_history(self, limit, kind=None, name=None):
+        return {"records": self._device.query_history(kind, name, limit=limit)}
+
+    async def replay_capture(self, path, speed, address=None):
+        from .capture import read_capture
+
+        _path = self._hass.config.path(path)
+        if not self._hass.config.is_allowed_path(_path):
+            raise HomeAssistantError("Path %s is not allowed" % path)
+        try:
+            records = await self._hass.async_add_executor_job(read_capture, _path)
+        except (OSError, ValueError) as e:
+            raise HomeAssistantError("Cannot read capture %s: %s" % (path, e)) from e
+
+        count, elapsed = await self._device.async_replay_capture(
+            records, speed, address
+        )
+        return {
+            "datagrams": count,
+            "elapsed": round(elapsed, 3),
+            "rate": round(count / elapsed, 1) if elapsed > 0 else None,
+        }
@@ -0,0 +1,86 @@
+"""Capabilities of each model of Emotiva processor."""
+
+from types import MappingProxyType
+from typing import NamedTuple
+
+from .volume import VOLUME_MAX, VOLUME_MIN
+
+
+class SoundMode(NamedTuple):
+    # Commands sent in turn to select the mode
+    commands: tuple
+    # Notification property reporting the mode's label and visibility
+    property: str
+
+
+class ModelProfile(NamedTuple):
+    name: str
+    # mode name -> SoundMode
+    modes: MappingProxyType
+    # (command, default label) for each source
+    sources: tuple
+    volume_min: float = VOLUME_MIN
+    volume_max: float = VOLUME_MAX
+
+    @property
+    def mode_properties(self):
+        return frozenset(mode.property for mode in self.modes.values())
+
+
+def _modes(**extra):
+    modes = {
+        "Stereo": SoundMode(("stereo",), "mode_stereo"),
+        "Direct": SoundMode(("direct",), "mode_direct"),
+        "Dolby": SoundMode(("dolby",), "mode_dolby"),
+        "DTS": SoundMode(("dts",), "mode_dts"),
+        "All Stereo": SoundMode(("all_stereo",), "mode_all_stereo"),
+        "Auto": SoundMode(("auto",), "mode_auto"),
+        "Reference Stereo": SoundMode(("reference_stereo",), "mode_ref_stereo"),
+        "Surround": SoundMode(("surround_mode",), "mode_surround"),
+    }
+    modes.update(extra)
+    return MappingProxyType(modes)
+
+
+_LEGACY_MODES = _modes(
+    **{
+        "PLIIx Music": SoundMode(("dolby", "music"), "mode_dolby"),
+        "PLIIx Movie": SoundMode(("dolby", "movie"), "mode_dolby"),
+        "dts Neo:6 Cinema": SoundMode(("dts", "movie"), "mode_dts"),
+        "dts Neo:6 Music": SoundMode(("dts", "music"), "mode_dts"),
+    }
+)
+
+_ATMOS_MODES = _modes(
+    **{
+        "Dolby Surround": SoundMode(("dolby",), "mode_dolby"),
+        "Dolby ATMOS": SoundMode(("dolby",), "mode_dolby"),
+        "dts Neural:X": SoundMode(("dts",), "mode_dts"),
+    }
+)
+
+# The processor's configurable inputs, which it reports with their labels
+# and visibility as input_1 to input_8.  The commands for individual
+# connectors, e.g. hdmi1, duplicate these without being reported, so they
+# aren't listed, but can still be sent with send_command.
+SOURCES = tuple(("source_%d" % n, "Input %d" % n) for n in range(1, 9))
+
+DEFAULT_PROFILE = ModelProfile("Default", _LEGACY_MODES, SOURCES)
+
+# Keyed by the model with spaces, dashes and underscores removed
+MODEL_PROFILES = MappingProxyType(
+    {
+        "XMC1": ModelProfile("XMC-1", _LEGACY_MODES, SOURCES),
+        "XMC2": ModelProfile("XMC-2", _ATMOS_MODES, SOURCES),
+        "RMC1": ModelProfile("RMC-1", _ATMOS_MODES, SOURCES),
+        "RMC1L": ModelProfile("RMC-1L", _ATMOS_MODES, SOURCES),
+    }
+)
+
+
+def get_profile(model):
+    """Return the profile for a model name as reported by the processor."""
+    stripped = (model or "").replace(" ", "").replace("-", "").replace("_", "").upper()
+    return MODEL_PROFILES.get(stripped[:5]) or MODEL_PROFILES.get(
+        stripped[:4], DEFAULT_PROFILE
+    )
@@ -0,0 +1,222 @@
+"""Request building and notification parsing for each Emotiva protocol version."""
+
+import logging
+import threading
+from xml.sax.saxutils import quoteattr
+
+_LOGGER = logging.getLogger(__name__)
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>'.encode("utf-8")
+
+# Root elements of the messages a processor sends to a controller
+NOTIFY_ROOTS = (
+    b"<emotivaNotify",
+    b"<emotivaUpdate",
+    b"<emotivaAck",
+    b"<emotivaMenuNotify",
+    b"<emotivaBarNotify",
+    b"<emotivaSubscription",
+    b"<emotivaUnsubscribe",
+)
+# Full notifications are well under this, even with every property
+MAX_DATAGRAM_SIZE = 8192
+# Longest XML declaration accepted before the root element, allowing for
+# encoding and standalone attributes
+_DECLARATION_LIMIT = 128
+
+
+def is_notification(data):
+    """Cheaply check that a datagram looks like a message from a processor."""
+    start = 0
+    if data.startswith(b"<?xml"):
+        start = data.find(b"?>", 5, _DECLARATION_LIMIT)
+        if start < 0:
+            return False
+        start += 2
+    while data[start : start + 1].isspace():
+        start += 1
+    return data.startswith(NOTIFY_ROOTS, start)
+
+
+def build_request(pkt_type, req=(), pkt_attrs={}):
+    """
+    req is a list of 2-element tuples with first element being the command,
+    and second being a dict of parameters. E.g.
+    ('power_on', {'value': "0"})
+
+    pkt_attrs is a dictionary containing element attributes. E.g.
+    {'protocol': "3.0"}
+    """
+    body = b"".join(_tag(cmd, params or {}, empty=True) for cmd, params in req)
+    if not body:
+        return XML_HEADER + _tag(pkt_type, pkt_attrs, empty=True)
+    return XML_HEADER + _tag(pkt_type, pkt_attrs) + body + _end_tag(pkt_type)
+
+
+def _tag(tag, attrs, empty=False):
+    return (
+        "<%s%s%s>"
+        % (
+            tag,
+            "".join(" %s=%s" % (k, quoteattr(str(v))) for k, v in attrs.items()),
+            "/" if empty else "",
+        )
+    ).encode("utf-8")
+
+
+def _end_tag(tag):
+    return ("</%s>" % tag).encode("utf-8")
+
+
+# lxml is only imported when the first response is parsed, so that the CLI
+# and the module's import stay light.  The integration preloads it in the
+# executor at setup.  A parser is kept per thread as discovery parses in the
+# executor
+_parsers = threading.local()
+
+
+def parse_response(data):
+    from lxml import etree
+
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = etree.XMLParser(ns_clean=True, recover=True)
+    try:
+        root = etree.XML(data, parser)
+    except etree.ParseError:
+        _LOGGER.error("Malformed XML")
+        _LOGGER.error(data)
+        root = ""
+    return root
+
+
+def parse_transponder(transp_xml):
+    """Return the details a processor reports in its transponder response."""
+    info = {}
+    for key, tag in (("name", "name"), ("model", "model")):
+        elem = transp_xml.find(tag)
+        if elem is not None and elem.text:
+            info[key] = elem.text.strip()
+
+    ctrl = transp_xml.find("control")
+    if ctrl is None:
+        return info
+    elem = ctrl.find("version")
+    if elem is not None:
+        info["version"] = float(elem.text)
+    for key, tag in (
+        ("control_port", "controlPort"),
+        ("notify_port", "notifyPort"),
+        ("info_port", "infoPort"),
+        ("setup_port", "setupPortTCP"),
+    ):
+        elem = ctrl.find(tag)
+        if elem is not None:
+            info[key] = int(elem.text)
+    return info
+
+
+_MESSAGE_TYPES = (
+    "emotivaSubscription",
+    "emotivaUnsubscribe",
+    "emotivaUpdate",
+    "emotivaControl",
+)
+
+
+class EmotivaProtocol(object):
+    """Message format for one version of the Emotiva network protocol.
+
+    Instances are shared and selected once per processor with
+    get_protocol(), so building a message never re-evaluates the version.
+    """
+
+    def __init__(self, version, header_attrs, property_elements):
+        self.version = version
+        self.header_attrs = dict(header_attrs)
+        # v3 notifications are sent as <property name="volume" .../> rather
+        # than <volume .../>
+        self.property_elements = property_elements
+        # The opening of each message is the same for every request
+        self._prefix = {
+            pkt_type: XML_HEADER + _tag(pkt_type, self.header_attrs)
+            for pkt_type in _MESSAGE_TYPES
+        }
+        self._suffix = {pkt_type: _end_tag(pkt_type) for pkt_type in _MESSAGE_TYPES}
+
+    def __repr__(self):
+        return "EmotivaProtocol(%s)" % self.version
+
+    def _message(self, pkt_type, body):
+        return self._prefix[pkt_type] + body + self._suffix[pkt_type]
+
+    def subscribe_request(self, events):
+        return self._message(
+            "emotivaSubscription", b"".join(_tag(ev, {}, empty=True) for ev in events)
+        )
+
+    def unsubscribe_request(self, events):
+        return self._message(
+            "emotivaUnsubscribe", b"".join(_tag(ev, {}, empty=True) for ev in events)
+        )
+
+    def update_request(self, events):
+        return self._message(
+            "emotivaUpdate", b"".join(_tag(ev, {}, empty=True) for ev in events)
+        )
+
+    def control_request(self, command, value):
+        return self._message(
+            "emotivaControl",
+            _tag(command, {"value": str(value), "ack": "no"}, empty=True),
+        )
+
+    def ping_request(self):
+        return build_request("emotivaPing", (), self.header_attrs)
+
+    def sequence(self, resp):
+        """Return the sequence number of a v3 notification, or None."""
+        if self.version < 3 or getattr(resp, "tag", None) != "emotivaNotify":
+            return None
+        try:
+            return int(resp.get("sequence"))
+        except (TypeError, ValueError):
+            return None
+
+    def property_name(self, elem):
+        """Return the property an element of a notification describes."""
+        if self.property_elements and elem.tag == "property":
+            return elem.get("name")
+        return elem.tag
+
+    def iter_properties(self, resp):
+        """Yield (name, value, visible) for each property in a notification."""
+        for elem in resp:
+            name = self.property_name(elem)
+            if name is None:
+                continue
+            yield (
+                name,
+                (elem.get("value") or "").strip(),
+                (elem.get("visible") or "").strip(),
+            )
+
+
+PROTOCOL_V2 = EmotivaProtocol(2.0, {}, property_elements=False)
+PROTOCOL_V3 = EmotivaProtocol(3.0, {"protocol": "3.0"}, property_elements=True)
+PROTOCOL_V3_1 = EmotivaProtocol(3.1, {"protocol": "3.1"}, property_elements=True)
+
+SUPPORTED_VERSIONS = ("3.1", "3.0", "2.0")
+
+
+def get_protocol(version):
+    """Return the newest protocol supported which is no later than version."""
+    try:
+        version = float(version)
+    except (TypeError, ValueError):
+        return PROTOCOL_V2
+    if version >= 3.1:
+        return PROTOCOL_V3_1
+    if version >= 3.0:
+        return PROTOCOL_V3
+    return PROTOCOL_V2
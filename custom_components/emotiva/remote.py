@@ -45,9 +45,7 @@ class EmotivaDevice(RemoteEntity):
         self._device = device
         self._hass = hass
         self._entity_id = "remote.emotivaprocessor"
-        self._unique_id = "emotiva_" + self._device.name.replace(" ", "_").replace(
-            "-", "_"
-        ).replace(":", "_")
+        self._unique_id = self._device.unique_id
 
     async def async_added_to_hass(self):
         """Handle being added to hass."""
@@ -0,0 +1,133 @@
+"""Mapping between processor volume in dB and Home Assistant volume levels."""
+
+from bisect import bisect_left
+
+VOLUME_STEP = 0.5
+VOLUME_MIN = -96.0
+VOLUME_MAX = 11.0
+
+CURVE_LINEAR = "linear"
+CURVE_LOGARITHMIC = "logarithmic"
+CURVE_TAPERED = "tapered"
+# Curves for volume ramps
+CURVES = (CURVE_LINEAR, CURVE_LOGARITHMIC)
+# Curves for the volume slider
+SLIDER_CURVES = (CURVE_LINEAR, CURVE_TAPERED)
+
+# The tapered slider's level is the fraction of the dB range to this power,
+# which on the full range puts -50dB to 0dB across nearly two thirds of it
+TAPER_POWER = 2
+
+# Steps closer together than this are sent as one
+RAMP_MIN_INTERVAL = 0.1
+
+
+def _loudness(db):
+    # Perceived loudness roughly doubles for every 10dB
+    return 2 ** (db / 10)
+
+
+def slider_curve(curve):
+    """Return the slider curve for a saved option, which may predate tapered."""
+    return CURVE_TAPERED if curve == CURVE_LOGARITHMIC else curve
+
+
+class VolumeCurve(object):
+    """Lookup tables between volume levels and the processor's 0.5dB steps.
+
+    The tables are built once for the listening limits and curve, so
+    converting in either direction is a lookup rather than a calculation.
+    """
+
+    def __init__(self, minimum=VOLUME_MIN, maximum=VOLUME_MAX, curve=CURVE_LINEAR):
+        self.minimum = self.quantise(max(VOLUME_MIN, min(minimum, VOLUME_MAX)))
+        self.maximum = self.quantise(max(VOLUME_MIN, min(maximum, VOLUME_MAX)))
+        if self.maximum <= self.minimum:
+            raise ValueError(
+                "Volume maximum %s must be above minimum %s" % (maximum, minimum)
+            )
+        self.curve = slider_curve(curve)
+
+        steps = int(round((self.maximum - self.minimum) / VOLUME_STEP))
+        self._db = tuple(self.minimum + i * VOLUME_STEP for i in range(steps + 1))
+
+        power = TAPER_POWER if self.curve == CURVE_TAPERED else 1
+        span = self.maximum - self.minimum
+        self._levels = tuple(((db - self.minimum) / span) ** power for db in self._db)
+
+        self._level_of = {
+            db: round(level, 3) for db, level in zip(self._db, self._levels)
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, VolumeCurve) and (
+            self.minimum,
+            self.maximum,
+            self.curve,
+        ) == (other.minimum, other.maximum, other.curve)
+
+    @staticmethod
+    def quantise(db):
+        """Round a volume in dB to the processor's step."""
+        return round(db / VOLUME_STEP) * VOLUME_STEP
+
+    def to_level(self, db):
+        """Return the volume level, 0..1, for a volume in dB."""
+        if db <= self.minimum:
+            return 0.0
+        if db >= self.maximum:
+            return 1.0
+        return self._level_of[self.quantise(db)]
+
+    def to_db(self, level):
+        """Return the nearest volume step in dB for a volume level."""
+        if level <= 0:
+            return self.minimum
+        if level >= 1:
+            return self.maximum
+        i = bisect_left(self._levels, level)
+        if level - self._levels[i - 1] < self._levels[i] - level:
+            i -= 1
+        return self._db[i]
+
+
+def ramp_schedule(start, target, duration, curve=CURVE_LINEAR):
+    """Return (seconds from start, volume in dB) for each command of a ramp.
+
+    Each 0.5dB step between start and target is timed from where the curve
+    passes it, linear in dB or in perceived loudness.  Steps due within
+    RAMP_MIN_INTERVAL of each other are coalesced into the last of them.
+    """
+    start = VolumeCurve.quantise(start)
+    target = VolumeCurve.quantise(target)
+    steps = int(round(abs(target - start) / VOLUME_STEP))
+    if steps == 0:
+        return []
+    if duration <= 0:
+        return [(0.0, target)]
+
+    direction = VOLUME_STEP if target > start else -VOLUME_STEP
+    if curve == CURVE_LOGARITHMIC:
+        low = _loudness(start)
+        span = _loudness(target) - low
+
+        def offset(db):
+            return duration * (_loudness(db) - low) / span
+
+    else:
+
+        def offset(db):
+            return duration * (db - start) / (target - start)
+
+    schedule = []
+    for i in range(1, steps + 1):
+        db = start + i * direction
+        at = offset(db)
+        if schedule and at - schedule[-1][0] < RAMP_MIN_INTERVAL:
+            if i < steps:
+                # Wait for the next step rather than sending this one
+                continue
+            # The target must always be sent, in place of the last step
+            schedule.pop()
+        schedule.append((at, db))
+    return schedule
@@ -0,0 +1,153 @@
+"""Fixtures for driving a processor session without a processor."""
+
+import asyncio
+import heapq
+import itertools
+
+import pytest
+
+from custom_components.emotiva.emotiva import Emotiva, EmotivaNotifiers
+from custom_components.emotiva.protocol import parse_response
+
+
+class FakeTimer(object):
+    def __init__(self, cb, args):
+        self.cb = cb
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeClock(object):
+    """Clock which only moves when advanced, running the timers due in order."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self._timers = []
+        self._order = itertools.count()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1700000000.0 + self.now
+
+    def call_later(self, delay, cb, *args):
+        return self.call_at(self.now + delay, cb, *args)
+
+    def call_at(self, when, cb, *args):
+        timer = FakeTimer(cb, args)
+        heapq.heappush(self._timers, (when, next(self._order), timer))
+        return timer
+
+    async def sleep(self, seconds):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        done = asyncio.get_running_loop().create_future()
+        self.call_later(seconds, lambda: done.done() or done.set_result(None))
+        await done
+
+    async def wait_for(self, aw, timeout):
+        fut = asyncio.ensure_future(aw)
+        expired = []
+
+        def _expire():
+            expired.append(True)
+            fut.cancel()
+
+        timer = self.call_later(timeout, _expire)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            if expired:
+                raise TimeoutError from None
+            raise
+        finally:
+            timer.cancel()
+
+    def create_task(self, coro, name=None):
+        return asyncio.get_running_loop().create_task(coro, name=name)
+
+    async def advance(self, seconds):
+        """Move time on, letting tasks run after each timer fires."""
+        end = self.now + seconds
+        await self._settle()
+        while self._timers and self._timers[0][0] <= end:
+            when, _, timer = heapq.heappop(self._timers)
+            self.now = max(self.now, when)
+            if not timer.cancelled:
+                timer.cb(*timer.args)
+            await self._settle()
+        self.now = end
+        await self._settle()
+
+    @staticmethod
+    async def _settle():
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+
+class FakeNotifier(object):
+    """Records the requests sent to the processor."""
+
+    local_address = "192.0.2.1"
+
+    def __init__(self):
+        self.sent = []
+
+    async def async_send(self, data, remote_addr):
+        self.sent.append(parse_response(data))
+
+    async def _async_register(self, callback, remote_ip, error_callback=None):
+        pass
+
+    async def _async_unregister(self, remote_ip):
+        pass
+
+    def commands(self, tag=None):
+        """Return (command, value) for each control request sent."""
+        return [
+            (elem.tag, elem.get("value"))
+            for req in self.sent
+            if req.tag == "emotivaControl"
+            for elem in req
+            if tag is None or elem.tag == tag
+        ]
+
+    def updates(self):
+        """Return the properties asked for by each update request sent."""
+        return [
+            [elem.tag for elem in req]
+            for req in self.sent
+            if req.tag == "emotivaUpdate"
+        ]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def notifier():
+    return FakeNotifier()
+
+
+@pytest.fixture
+def processor(clock, notifier):
+    device = Emotiva(
+        "192.0.2.10",
+        _ctrl_port=7002,
+        _notify_port=7003,
+        _name="Test Processor",
+        _model="RMC-1",
+        _proto_ver=3.0,
+        clock=clock,
+    )
+    notifiers = EmotivaNotifiers()
+    notifiers.command = notifiers.subscription = notifier
+    device.set_notifiers(notifiers)
+    return device
@@ -0,0 +1,286 @@
+"""Tests of the processor session, driven by a simulated clock."""
+
+import asyncio
+
+from custom_components.emotiva.capture import DIRECTION_IN
+from custom_components.emotiva.emotiva import (
+    Emotiva,
+    EmotivaNotifiers,
+    EmotivaTransponderListener,
+)
+
+from .conftest import FakeNotifier
+
+
+def notification(sequence=None, **properties):
+    """Return a v3 notification datagram with the properties given."""
+    attrs = "" if sequence is None else ' sequence="%d"' % sequence
+    body = "".join(
+        '<property name="%s" value="%s" visible="true"/>' % (name, value)
+        for name, value in properties.items()
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><emotivaNotify%s>%s</emotivaNotify>'
+        % (attrs, body)
+    ).encode()
+
+
+TRANSPONDER = (
+    b'<?xml version="1.0" encoding="utf-8"?><emotivaTransponder>'
+    b"<model>XMC-2</model><name>Theatre</name><control><version>3.0</version>"
+    b"<controlPort>7002</controlPort><notifyPort>7003</notifyPort></control>"
+    b"</emotivaTransponder>"
+)
+
+
+def test_unconfirmed_command_rolls_back(processor, clock):
+    async def run():
+        processor._current_state["power"] = "Off"
+        await processor.async_turn_on()
+        assert processor.power
+        assert processor.pending == ("power",)
+
+        await clock.advance(Emotiva.OPTIMISTIC_TIMEOUT - 0.1)
+        assert processor.power
+        await clock.advance(0.2)
+        assert not processor.power
+        assert processor.pending == ()
+
+    asyncio.run(run())
+
+
+def test_confirmed_command_records_latency(processor, clock):
+    async def run():
+        processor._current_state["power"] = "Off"
+        await processor.async_turn_on()
+        await clock.advance(0.5)
+        processor._notify_handler(notification(power="On"))
+        await clock.advance(Emotiva.OPTIMISTIC_TIMEOUT)
+        assert processor.power
+        assert processor.query_history("latency") == [
+            {"time": 1700001000.5, "kind": "latency", "name": "power", "value": 0.5}
+        ]
+
+    asyncio.run(run())
+
+
+def test_repeated_pending_command_is_sent(processor, notifier):
+    async def run():
+        processor._current_state["power"] = "Off"
+        await processor.async_turn_on()
+        await processor.async_turn_on()
+        await processor.async_turn_off()
+        assert notifier.commands() == [
+            ("power_on", "0"),
+            ("power_on", "0"),
+            ("power_off", "0"),
+        ]
+
+    asyncio.run(run())
+
+
+def test_sequence_gaps_resync_and_stale_notifications_are_dropped(
+    processor, clock, notifier
+):
+    async def run():
+        await processor.async_subscribe_events()
+        processor._notify_handler(notification(1, volume="-40.0"))
+        processor._notify_handler(notification(2, volume="-39.5"))
+        processor._notify_handler(notification(4, volume="-38.5"))
+        await clock.advance(0)
+        assert ["volume"] in notifier.updates()
+
+        # The lost notification arrives late, and the last one is repeated
+        processor._notify_handler(notification(3, volume="-39.0"))
+        processor._notify_handler(notification(4, volume="-38.5"))
+        assert processor.volume == -38.5
+        stats = processor.diagnostics()["sequence"]
+        assert stats["lost"] == 0
+        assert stats["reordered"] == 1
+        assert stats["duplicates"] == 1
+        assert stats["resyncs"] == 1
+
+    asyncio.run(run())
+
+
+def test_volume_ramp_completes(processor, clock, notifier):
+    async def run():
+        processor._current_state["volume"] = "-40.0"
+        await processor.async_volume_ramp(processor._volume_curve.to_level(-30), 10)
+        assert processor.ramping
+
+        await clock.advance(5)
+        assert processor.volume == -35.0
+        await clock.advance(5)
+        assert not processor.ramping
+        steps = notifier.commands("set_volume")
+        assert len(steps) == 20
+        assert steps[-1] == ("set_volume", "-30.0")
+
+    asyncio.run(run())
+
+
+def test_volume_ramp_stops_when_changed_on_processor(processor, clock, notifier):
+    async def run():
+        processor._current_state["volume"] = "-40.0"
+        await processor.async_volume_ramp(processor._volume_curve.to_level(-30), 10)
+        await clock.advance(2)
+
+        # A notification for the step before the last is still the ramp's own
+        processor._notify_handler(notification(volume="-38.5"))
+        assert processor.ramping
+
+        processor._notify_handler(notification(volume="-20.0"))
+        assert not processor.ramping
+        sent = len(notifier.commands("set_volume"))
+        await clock.advance(10)
+        assert len(notifier.commands("set_volume")) == sent
+        assert processor.volume == -20.0
+
+    asyncio.run(run())
+
+
+def test_volume_ramp_ignores_late_notifications(processor, clock, notifier):
+    send = notifier.async_send
+
+    async def echo_late(data, remote_addr):
+        # The processor reports each volume set a quarter of a second later
+        await send(data, remote_addr)
+        if b"set_volume" in data:
+            value = notifier.commands("set_volume")[-1][1]
+            clock.call_later(
+                0.25, processor._notify_handler, notification(volume=value)
+            )
+
+    notifier.async_send = echo_late
+
+    async def run():
+        processor._current_state["volume"] = "-60.0"
+        await processor.async_volume_ramp(processor._volume_curve.to_level(-20), 8)
+        await clock.advance(9)
+        assert processor.diagnostics()["volume_ramp"]["completed"] == 1
+        assert processor.volume == -20.0
+
+    asyncio.run(run())
+
+
+def test_restored_standby_is_kept_when_confirmed(processor, clock):
+    class Store(object):
+        async def async_load(self):
+            return {"state": {"power": "Off"}}
+
+        def async_delay_save(self, data_func, delay):
+            pass
+
+    async def run():
+        processor.set_store(Store())
+        await processor.async_restore_state()
+        await processor.async_subscribe_events()
+        processor._notify_handler(notification(power="Off"))
+        await clock.advance(1)
+        assert processor.diagnostics()["idle"]
+        assert "audio_bitstream" not in processor.diagnostics()["subscribed"]
+
+    asyncio.run(run())
+
+
+def test_leaving_standby_refreshes_once(processor, clock, notifier):
+    async def run():
+        await processor.async_subscribe_events()
+        processor._notify_handler(notification(power="Off"))
+        await clock.advance(1)
+        notifier.sent.clear()
+
+        processor._notify_handler(notification(power="On"))
+        await clock.advance(1)
+        updates = notifier.updates()
+        assert len(updates) == 1
+        assert "audio_bitstream" in updates[0]
+        assert "power" in updates[0]
+
+    asyncio.run(run())
+
+
+def test_moved_processor_uses_notifiers_facing_it(processor, notifier):
+    async def run():
+        await processor.async_subscribe_events()
+        moved = FakeNotifier()
+        notifiers = EmotivaNotifiers()
+        notifiers.command = notifiers.subscription = moved
+        await processor.async_set_address("198.51.100.10", notifiers)
+
+        assert processor.address == "198.51.100.10"
+        assert [req.tag for req in moved.sent] == ["emotivaSubscription"]
+        await processor.async_turn_on()
+        assert moved.commands() == [("power_on", "0")]
+        assert notifier.commands() == []
+
+    asyncio.run(run())
+
+
+def test_replay_includes_captures_from_other_networks(processor):
+    records = [
+        (10.0, DIRECTION_IN, ("10.0.0.5", 7003), notification(volume="-30.0")),
+        (10.5, DIRECTION_IN, ("10.0.0.6", 7003), notification(volume="-25.0")),
+    ]
+
+    async def run():
+        count, _ = await processor.async_replay_capture(records, speed=0)
+        assert count == 2
+        assert processor.volume == -25.0
+        count, _ = await processor.async_replay_capture(
+            records, speed=0, address="10.0.0.5"
+        )
+        assert count == 1
+        assert processor.volume == -30.0
+
+    asyncio.run(run())
+
+
+def test_contrary_notification_does_not_confirm(processor, clock):
+    async def run():
+        processor._current_state["power"] = "Off"
+        command = asyncio.ensure_future(processor.async_command("power_on"))
+        await clock.advance(0.2)
+        processor._notify_handler(notification(power="Off"))
+        await clock.advance(0)
+        assert await command == {"sent": True, "confirmed": False, "latency": None}
+        assert not processor.power
+        assert processor.pending == ()
+        assert processor.query_history("latency") == []
+
+    asyncio.run(run())
+
+
+def test_volume_notification_does_not_confirm_mute(processor, clock):
+    async def run():
+        processor._current_state["volume"] = "-40.0"
+        await processor.async_set_mute(True)
+        processor._notify_handler(notification(volume="-40.0"))
+        assert not processor.mute
+        assert processor.query_history("latency") == []
+
+        await processor.async_set_mute(True)
+        await clock.advance(0.3)
+        processor._notify_handler(notification(volume="Mute"))
+        assert processor.mute
+        assert [r["name"] for r in processor.query_history("latency")] == ["mute"]
+
+    asyncio.run(run())
+
+
+def test_discovery_through_listener_times_out_on_its_clock(clock):
+    listener = EmotivaTransponderListener(clock)
+
+    async def run():
+        search = asyncio.ensure_future(
+            Emotiva.async_discover(timeout=2, listener=listener)
+        )
+        await clock.advance(1)
+        listener.datagram_received(TRANSPONDER, ("192.0.2.20", 7000))
+        assert listener.seen["192.0.2.20"][1] == clock.now
+        assert not search.done()
+        await clock.advance(1)
+        assert [ip for ip, _xml in await search] == ["192.0.2.20"]
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+"""Tests of the volume slider curves."""
+
+from custom_components.emotiva.volume import (
+    CURVE_LOGARITHMIC,
+    CURVE_TAPERED,
+    VolumeCurve,
+)
+
+
+def test_tapered_curve_spreads_listening_levels():
+    curve = VolumeCurve(curve=CURVE_TAPERED)
+    assert curve.to_level(-50) < 0.2
+    assert curve.to_level(0) > 0.8
+    assert curve.to_db(0.5) == -20.5
+    for db in (-60.0, -35.5, -20.0, 0.0):
+        assert curve.to_db(curve.to_level(db)) == db
+
+
+def test_saved_logarithmic_option_is_tapered():
+    assert VolumeCurve(curve=CURVE_LOGARITHMIC) == VolumeCurve(curve=CURVE_TAPERED)